@@ -1,13 +1,10 @@
 import mysql.connector
 from mysql.connector import Error
-import vertexai
-from vertexai.generative_models import GenerativeModel, HarmCategory, HarmBlockThreshold
+from llm_client import generate_text, DEFAULT_MODEL
 import os
 import sys
 
 
-GCP_PROJECT_ID = ""  
-GCP_LOCATION = "us-central1"
 DB_CONFIG = {
     'host': 'localhost',
     'user': 'root',
@@ -53,26 +50,13 @@ def save_analysis_to_db(connection, analysis_type, content):
         cursor.close()
 
 
-def call_gemini_api(prompt, model_name="gemini-2.0-flash-lite-001"):
-    """Calls the Gemini API and returns the response text."""
-    try:
-        model = GenerativeModel(model_name)
-        safety_settings = {
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        }
-        response = model.generate_content(prompt, safety_settings=safety_settings)
-        if response.candidates and response.candidates[0].content.parts:
-            return response.text.strip()
-        else:
-            reason = response.candidates[0].finish_reason.name if response.candidates else "UNKNOWN"
-            print(f" Response was blocked. Reason: {reason}")
-            return None
-    except Exception as e:
-        print(f" Vertex AI API Error: {e}")
+def call_gemini_api(prompt, model_name=DEFAULT_MODEL):
+    """Calls the Gemini API through the shared LLM client and returns the response text, or None."""
+    success, text = generate_text(prompt, model_name)
+    if not success:
+        print(f" LLM call failed: {text}")
         return None
+    return text
 
 
 def run_comparative_analysis():
@@ -136,7 +120,6 @@ def run_comparative_analysis():
 if __name__ == '_main_':
     try:
         print("Initializing Comparative Analysis Agent for standalone run...")
-        vertexai.init(project=GCP_PROJECT_ID, location=GCP_LOCATION)
         run_comparative_analysis()
     except Exception as e:
         print(f" An unexpected error occurred: {e}")
@@ -1,14 +1,11 @@
 import mysql.connector
 from mysql.connector import Error
-import vertexai
-from vertexai.generative_models import GenerativeModel, HarmCategory, HarmBlockThreshold
+from llm_client import generate_text, DEFAULT_MODEL
 import os
 import sys
 import time
 
 
-GCP_PROJECT_ID = ""  
-GCP_LOCATION = "us-central1"            
 DB_CONFIG = {
     'host': 'localhost',
     'user': 'root',
@@ -17,9 +14,6 @@ DB_CONFIG = {
 }
 
 
-vertexai.init(project=GCP_PROJECT_ID, location=GCP_LOCATION)
-
-
 def get_db_connection():
     """Establishes and returns a new database connection."""
     try:
@@ -58,35 +52,9 @@ def save_final_analysis(connection, analysis_type, content):
         cursor.close()
 
 
-def call_gemini_api(prompt, model_name="gemini-2.0-flash-lite-001"):
-    """Calls the Gemini API with a given prompt and robust error handling."""
-    model = GenerativeModel(model_name)
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    }
-
-    max_retries = 5
-    delay = 15
-    for attempt in range(max_retries):
-        try:
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-            if response.candidates and response.candidates[0].content.parts:
-                return True, response.text.strip()
-            else:
-                reason = response.candidates[0].finish_reason.name if response.candidates else "UNKNOWN"
-                return False, f"Response was blocked. Reason: {reason}"
-        except Exception as e:
-            if "429" in str(e):
-                print(f"Rate limit hit. Waiting for {delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                time.sleep(delay)
-                delay *= 2
-            else:
-                return False, f"Vertex AI API Error: {e}"
-                
-    return False, "Failed to get response after multiple retries due to rate limiting."
+def call_gemini_api(prompt, model_name=DEFAULT_MODEL):
+    """Calls the Gemini API through the shared LLM client. Returns (success, text or reason)."""
+    return generate_text(prompt, model_name)
 
 
 def run_gap_identification_agent():
@@ -3,6 +3,16 @@ from mysql.connector import Error
 import fitz  
 import os
 import sys
+import re
+import time
+import json
+import zlib
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from fulltext_store import save_full_texts, load_pages, print_storage_stats
 
 DB_CONFIG = {
     'host': 'localhost',
@@ -12,10 +22,62 @@ DB_CONFIG = {
 }
 DOWNLOADS_DIR = 'downloads'
 
+# Number of worker processes used for PDF text extraction. Set to 1 to
+# extract in the main process, one PDF at a time.
+PREPROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Workers are started with 'spawn' rather than fork: preprocessing runs next to
+# retrieval threads (and the Streamlit server), and a forked child can inherit
+# a lock held by one of them and hang.
+PREPROCESS_START_METHOD = 'spawn'
+
+# Full-text updates are committed in transactions of at most this many bytes
+# of text (or rows), keeping each one well under max_allowed_packet.
+FULL_TEXT_BATCH_BYTES = 8 * 1024 * 1024
+FULL_TEXT_BATCH_MAX_ROWS = 50
+
+# Text is read page by page and stored per page in paper_pages. Extraction
+# stops at whichever of these caps is reached first.
+MAX_PAGES_PER_DOC = 500
+MAX_TEXT_BYTES_PER_DOC = 2 * 1024 * 1024
+
+# Section headings recognised while extracting. A line counts as a heading
+# when it matches one of these names and is numbered, bold, all caps, or set
+# in a larger font than the page's body text.
+SECTION_PATTERNS = [
+    ('abstract', re.compile(r'abstract')),
+    ('introduction', re.compile(r'introduction|background|motivation')),
+    ('methods', re.compile(r'methods?|methodology|materials and methods|(proposed )?(approach|framework|model|system)|problem (formulation|statement)')),
+    ('results', re.compile(r'experiments?|experimental (setup|results|evaluation|study)|results?( and analysis)?|evaluation|(datasets?|data) and (setup|methods)|datasets?')),
+    ('discussion', re.compile(r'discussion|results and discussion|limitations?|threats to validity')),
+    ('conclusion', re.compile(r'conclusions?|concluding remarks|conclusions? and future (work|directions)|summary( and conclusions?)?|future work')),
+    ('references', re.compile(r'references|bibliography|works cited|literature cited')),
+    ('acknowledgements', re.compile(r'acknowledge?ments?')),
+    ('appendix', re.compile(r'appendix( [a-z])?|appendices|supplementary material')),
+]
+HEADING_NUMBER = re.compile(r'^(?:\d+(?:\.\d+)*\.?|[IVX]+\.|[A-H]\.)\s+')
+HEADING_FONT_RATIO = 1.15
+MAX_HEADING_CHARS = 80
+
+# Extracted documents are cached in extraction_cache, which clear_database
+# leaves alone, keyed by the PDF's SHA-256 and this version string. Bump
+# EXTRACTOR_VERSION whenever the extraction output changes.
+EXTRACTOR_VERSION = "sections-1"
+EXTRACTION_CACHE_VERSION = f"{EXTRACTOR_VERSION}/pymupdf-{getattr(fitz, 'VersionBind', 'unknown')}"
+EXTRACTION_CACHE_LOOKUP_CHUNK = 200
+EXTRACTION_CACHE_COMPRESSION_LEVEL = 6
+
+# In watch mode, papers1 is polled this often (seconds) for newly saved papers
+# until the caller signals that retrieval has finished.
+WATCH_POLL_SECONDS = 2.0
+
+db_connect_count = 0
+
 
 def get_db_connection():
     """Establishes and returns a new database connection."""
+    global db_connect_count
     try:
+        db_connect_count += 1
         connection = mysql.connector.connect(**DB_CONFIG)
         if connection.is_connected():
             return connection
@@ -24,76 +86,534 @@ def get_db_connection():
         return None
 
 def get_papers_without_full_text(connection):
-    """Fetches papers that have a file path but no extracted full text."""
+    """Fetches papers that have a file path or PDF digest but no extracted full text."""
     cursor = connection.cursor(dictionary=True)
-    query = "SELECT id, file_path FROM papers1 WHERE file_path IS NOT NULL AND full_text IS NULL"
+    query = """
+        SELECT p.id, p.file_path, p.pdf_sha256 FROM papers1 p
+        LEFT JOIN paper_texts t ON t.paper_id = p.id
+        WHERE (p.file_path IS NOT NULL OR p.pdf_sha256 IS NOT NULL) AND t.paper_id IS NULL
+    """
     cursor.execute(query)
     results = cursor.fetchall()
     cursor.close()
     return results
 
-def update_paper_with_full_text(connection, paper_id, full_text):
-    """Updates a paper record with the extracted full text."""
+def get_paper_pages(connection, paper_id, first_page=1, last_page=None):
+    """Returns the text of a page range (1-based, inclusive) without loading the whole document."""
+    return "".join(load_pages(connection, paper_id, first_page, last_page))
+
+
+def file_sha256(filepath):
+    """Returns the SHA-256 hex digest of a file, or None if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    except OSError as e:
+        print(f"    Could not hash {os.path.basename(filepath)}: {e}")
+        return None
+    return digest.hexdigest()
+
+
+def compress_document(document):
+    """Serialises an extracted document to zlib-compressed JSON."""
+    payload = json.dumps({'pages': document['pages'], 'sections': document['sections']}, ensure_ascii=False)
+    return zlib.compress(payload.encode('utf-8'), EXTRACTION_CACHE_COMPRESSION_LEVEL)
+
+
+def decompress_document(blob):
+    """Inverse of compress_document."""
+    document = json.loads(zlib.decompress(blob).decode('utf-8'))
+    document['sections'] = [tuple(section) for section in document['sections']]
+    return document
+
+
+def get_cached_documents(connection, digests, version=EXTRACTION_CACHE_VERSION):
+    """Returns {pdf_sha256: document} for the digests already in the extraction cache."""
+    digests = sorted(set(d for d in digests if d))
+    documents = {}
     cursor = connection.cursor()
-    query = "UPDATE papers1 SET full_text = %s WHERE id = %s"
     try:
-        cursor.execute(query, (full_text, paper_id))
-        connection.commit()
-        print(f" Successfully saved full text for paper ID: {paper_id}")
+        for i in range(0, len(digests), EXTRACTION_CACHE_LOOKUP_CHUNK):
+            chunk = digests[i:i + EXTRACTION_CACHE_LOOKUP_CHUNK]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"SELECT pdf_sha256, content FROM extraction_cache "
+                f"WHERE extractor_version = %s AND pdf_sha256 IN ({placeholders})",
+                (version, *chunk)
+            )
+            for digest, blob in cursor.fetchall():
+                try:
+                    documents[digest] = decompress_document(bytes(blob))
+                except (zlib.error, ValueError, KeyError) as e:
+                    print(f"    Ignoring unreadable cache entry {digest[:12]}: {e}")
     except Error as e:
-        print(f" Error updating paper ID {paper_id}: {e}")
+        print(f" Extraction cache lookup failed, extracting everything: {e}")
     finally:
         cursor.close()
+    return documents
+
+
+def store_cached_documents(cursor, rows, version=EXTRACTION_CACHE_VERSION):
+    """Upserts (pdf_sha256, document) rows into the extraction cache. Returns the compressed bytes written."""
+    cache_rows = [(digest, version, compress_document(document)) for digest, document in rows]
+    if cache_rows:
+        cursor.executemany(
+            "INSERT INTO extraction_cache (pdf_sha256, extractor_version, content) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE content = VALUES(content)",
+            cache_rows
+        )
+    return sum(len(blob) for _, _, blob in cache_rows)
+
+
+class FullTextWriter:
+    """
+    Buffers full-text and per-page updates on a single connection and commits
+    them in one transaction per batch. A batch is flushed once its text
+    reaches FULL_TEXT_BATCH_BYTES or FULL_TEXT_BATCH_MAX_ROWS papers.
+    Documents added with a digest are also stored in the extraction cache.
+    """
+
+    def __init__(self, connection, max_bytes=FULL_TEXT_BATCH_BYTES, max_rows=FULL_TEXT_BATCH_MAX_ROWS):
+        self.connection = connection
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.rows = []
+        self.pending_bytes = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.commit_latencies = []
+        self.cache_entries_written = 0
+        self.cache_bytes_written = 0
+        self.stored_bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, paper_id, document, digest=None):
+        """Queues a paper's extracted document and flushes if the batch is full."""
+        size = sum(len(page.encode('utf-8')) for page in document['pages'])
+        if self.rows and self.pending_bytes + size > self.max_bytes:
+            self.flush()
+        self.rows.append((paper_id, document, digest))
+        self.pending_bytes += size
+        if self.pending_bytes >= self.max_bytes or len(self.rows) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        """Writes all queued updates in one transaction."""
+        if not self.rows:
+            return
+        rows, batch_bytes = self.rows, self.pending_bytes
+        self.rows, self.pending_bytes = [], 0
+
+        cursor = self.connection.cursor()
+        try:
+            self._write_rows(cursor, rows)
+            start_time = time.perf_counter()
+            self.connection.commit()
+            self.commit_latencies.append(time.perf_counter() - start_time)
+            self.rows_written += len(rows)
+            self.bytes_written += batch_bytes
+            print(f" Saved full text for {len(rows)} papers ({batch_bytes / 1024:.0f} KB) in one transaction.")
+        except Error as e:
+            print(f" Error saving batch of {len(rows)} full texts: {e}. Retrying one by one.")
+            self.connection.rollback()
+            for paper_id, document, digest in rows:
+                try:
+                    self._write_rows(cursor, [(paper_id, document, digest)])
+                    self.connection.commit()
+                    self.rows_written += 1
+                    print(f" Successfully saved full text for paper ID: {paper_id}")
+                except Error as row_error:
+                    print(f" Error updating paper ID {paper_id}: {row_error}")
+                    self.connection.rollback()
+        finally:
+            cursor.close()
+
+    def _write_rows(self, cursor, rows):
+        """Stores the compressed pages (see fulltext_store) and the section index."""
+        _, stored_bytes = save_full_texts(cursor, [(paper_id, document['pages']) for paper_id, document, _ in rows])
+        self.stored_bytes_written += stored_bytes
+        cursor.executemany("DELETE FROM paper_sections WHERE paper_id = %s", [(paper_id,) for paper_id, _, _ in rows])
+        cache_rows = [(digest, document) for _, document, digest in rows if digest]
+        if cache_rows:
+            self.cache_bytes_written += store_cached_documents(cursor, cache_rows)
+            self.cache_entries_written += len(cache_rows)
+        for paper_id, document, _ in rows:
+            if document['sections']:
+                cursor.executemany(
+                    "INSERT INTO paper_sections (paper_id, section, start_offset, end_offset) VALUES (%s, %s, %s, %s)",
+                    [(paper_id, section, start, end) for section, start, end in document['sections']]
+                )
+
+    def report(self):
+        """Prints write metrics for the stage."""
+        print(f"\n Preprocessing metrics:")
+        print(f"   - Database connections opened: {db_connect_count}")
+        print(f"   - Full texts written: {self.rows_written} ({self.bytes_written / (1024 * 1024):.1f} MB, "
+              f"{self.stored_bytes_written / (1024 * 1024):.1f} MB compressed)")
+        if self.commit_latencies:
+            average = sum(self.commit_latencies) / len(self.commit_latencies)
+            print(f"   - Batches committed: {len(self.commit_latencies)} "
+                  f"(avg commit {average * 1000:.1f} ms, max {max(self.commit_latencies) * 1000:.1f} ms)")
+        print(f"   - Extraction cache entries stored: {self.cache_entries_written} "
+              f"({self.cache_bytes_written / (1024 * 1024):.1f} MB compressed)")
+
+
+def classify_heading(line_text):
+    """Returns (section, numbered) if the line reads like a section heading, else (None, False)."""
+    text = line_text.strip()
+    if not text or len(text) > MAX_HEADING_CHARS:
+        return None, False
+    numbered = HEADING_NUMBER.match(text)
+    if numbered:
+        text = text[numbered.end():]
+    normalized = re.sub(r'\s+', ' ', text).strip(' .:').lower()
+    if re.match(r'abstract\W', normalized):
+        return 'abstract', bool(numbered)
+    for section, pattern in SECTION_PATTERNS:
+        if pattern.fullmatch(normalized):
+            return section, bool(numbered)
+    return None, False
+
+
+def _page_text_and_headings(page):
+    """
+    Rebuilds a page's text from PyMuPDF's span dictionary and returns it with
+    the (section, offset) headings found on the page. Font size and bold
+    flags of each line are compared with the page's dominant body font size.
+    """
+    lines = []
+    size_weights = {}
+    for block in page.get_text("dict").get("blocks", []):
+        if block.get("type") != 0:
+            continue
+        for line in block.get("lines", []):
+            spans = [span for span in line.get("spans", []) if span.get("text")]
+            text = "".join(span["text"] for span in spans)
+            max_size = max((span.get("size", 0) for span in spans), default=0)
+            visible = [span for span in spans if span["text"].strip()]
+            bold = bool(visible) and all(span.get("flags", 0) & 16 or "bold" in span.get("font", "").lower() for span in visible)
+            for span in spans:
+                size = round(span.get("size", 0), 1)
+                size_weights[size] = size_weights.get(size, 0) + len(span["text"])
+            lines.append((text, max_size, bold))
+        lines.append(("", 0, False))
+
+    body_size = max(size_weights, key=size_weights.get) if size_weights else 0
+    page_text = ""
+    headings = []
+    for text, max_size, bold in lines:
+        section, numbered = classify_heading(text)
+        if section:
+            larger = body_size and max_size >= body_size * HEADING_FONT_RATIO
+            upper = any(c.isalpha() for c in text) and text.isupper()
+            if numbered or bold or larger or upper or section == 'abstract':
+                headings.append((section, len(page_text)))
+        page_text += text + "\n"
+    return page_text, headings
+
+
+def iter_pdf_pages(doc, max_pages=MAX_PAGES_PER_DOC, max_bytes=MAX_TEXT_BYTES_PER_DOC):
+    """Yields (page_text, headings) one page at a time, stopping at the page or byte cap."""
+    total_bytes = 0
+    for page_number, page in enumerate(doc):
+        if page_number >= max_pages:
+            return
+        text, headings = _page_text_and_headings(page)
+        size = len(text.encode('utf-8'))
+        if total_bytes + size > max_bytes:
+            remaining = max_bytes - total_bytes
+            text = text.encode('utf-8')[:remaining].decode('utf-8', errors='ignore')
+            yield text, [(section, offset) for section, offset in headings if offset < len(text)]
+            return
+        total_bytes += size
+        yield text, headings
+
+
+def build_section_index(headings, text_length):
+    """Turns ordered (section, start_offset) headings into (section, start, end) ranges."""
+    sections = []
+    for i, (section, start) in enumerate(headings):
+        end = headings[i + 1][1] if i + 1 < len(headings) else text_length
+        if end > start:
+            sections.append((section, start, end))
+    return sections
+
+
+def extract_document_from_pdf(filepath):
+    """
+    Extracts the text of each page of a PDF, up to the configured caps, and
+    the section index of the document. Returns {'pages', 'sections'}, where
+    section offsets refer to the joined page texts, or None on failure.
+    """
+    return _extract_document(lambda: fitz.open(filepath), os.path.basename(filepath))
+
+
+def extract_document_from_bytes(data, name):
+    """Same as extract_document_from_pdf for a PDF that is already in memory."""
+    return _extract_document(lambda: fitz.open(stream=data, filetype="pdf"), name)
 
 
-def extract_text_from_pdf(filepath):
-    """Extracts all text content from a given PDF file."""
+def _extract_document(open_doc, name):
     try:
-        doc = fitz.open(filepath)
-        text = "".join(page.get_text() for page in doc)
-        doc.close()
-        return text
+        doc = open_doc()
+        try:
+            pages = []
+            headings = []
+            offset = 0
+            for text, page_headings in iter_pdf_pages(doc):
+                headings.extend((section, offset + page_offset) for section, page_offset in page_headings)
+                pages.append(text)
+                offset += len(text)
+            if len(pages) < len(doc):
+                print(f"    {name}: extraction capped at {len(pages)} of {len(doc)} pages.")
+        finally:
+            doc.close()
+        return {'pages': pages, 'sections': build_section_index(headings, offset)}
     except Exception as e:
-        print(f"    Error reading PDF {os.path.basename(filepath)}: {e}")
+        print(f"    Error reading PDF {name}: {e}")
         return None
 
 
-def run_preprocessing(): 
-    """Main entry point for the preprocessing agent."""
+def extract_texts_serially(papers):
+    """Yields (paper, document) for each paper, extracting in the current process."""
+    for paper in papers:
+        yield paper, extract_document_from_pdf(paper['file_path'])
+
+
+class ExtractionPool:
+    """
+    A process pool for PDF extraction that is started once and reused across
+    batches (e.g. every poll of a watch session). A pool broken by a crashed
+    worker is replaced on the next batch. Call close() when done.
+    """
+
+    def __init__(self, workers=PREPROCESS_WORKERS):
+        self.workers = workers
+        self.executor = None
+
+    def get(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(PREPROCESS_START_METHOD)
+            )
+        return self.executor
+
+    def discard(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def _extract_in_isolation(paper):
+    """Extracts a single PDF in its own worker process so a crash only affects that PDF."""
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(PREPROCESS_START_METHOD)) as pool:
+            return pool.submit(extract_document_from_pdf, paper['file_path']).result()
+    except BrokenProcessPool:
+        print(f"    Worker process crashed while reading {os.path.basename(paper['file_path'])}. Skipping this PDF.")
+    except Exception as e:
+        print(f"    Error reading PDF {os.path.basename(paper['file_path'])}: {e}")
+    return None
+
+
+def extract_texts_in_parallel(papers, pool=None):
+    """
+    Yields (paper, document) as extractions finish on an ExtractionPool (a
+    temporary one if none is given). Only a few PDFs per worker are queued at
+    a time. If a worker crashes, the PDFs that were queued are re-run one per
+    process, so a bad PDF cannot take the whole batch down.
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = ExtractionPool()
+    try:
+        yield from _extract_on_pool(list(papers), pool)
+    finally:
+        if own_pool:
+            pool.close()
+
+
+def _extract_on_pool(queue, extraction_pool):
+    workers = extraction_pool.workers
+    while queue:
+        suspects = []
+        pool = extraction_pool.get()
+        pending = {}
+        while queue or pending:
+            while queue and len(pending) < workers * 2:
+                paper = queue.pop(0)
+                pending[pool.submit(extract_document_from_pdf, paper['file_path'])] = paper
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                paper = pending.pop(future)
+                try:
+                    yield paper, future.result()
+                except BrokenProcessPool:
+                    suspects.append(paper)
+                except Exception as e:
+                    print(f"    Error reading PDF {os.path.basename(paper['file_path'])}: {e}")
+                    yield paper, None
+
+            if suspects:
+                suspects.extend(pending.values())
+                extraction_pool.discard()
+                break
+
+        if suspects:
+            print(f"    A worker process crashed. Re-running {len(suspects)} PDFs one at a time...")
+            for paper in suspects:
+                yield paper, _extract_in_isolation(paper)
+
+
+def preprocess_papers(db_conn, writer, papers_to_process, pool=None):
+    """
+    Fills full text for the given papers from the extraction cache or by
+    extracting their PDFs, on pool (an ExtractionPool) if given.
+    """
+    print(f"Found {len(papers_to_process)} papers to preprocess.")
+    for paper in papers_to_process:
+        if not paper.get('pdf_sha256') and paper['file_path']:
+            paper['pdf_sha256'] = file_sha256(paper['file_path'])
+
+    cache_start = time.perf_counter()
+    cached = get_cached_documents(db_conn, [paper['pdf_sha256'] for paper in papers_to_process])
+    misses = [paper for paper in papers_to_process if paper['pdf_sha256'] not in cached]
+    hits = len(papers_to_process) - len(misses)
+    # Papers downloaded in fused mode without an archive copy can only come from the cache.
+    unavailable = [paper for paper in misses if not paper['file_path']]
+    if unavailable:
+        print(f"Skipping {len(unavailable)} papers with no cached text and no archived PDF.")
+        misses = [paper for paper in misses if paper['file_path']]
+
+    for paper in papers_to_process:
+        if paper['pdf_sha256'] in cached:
+            writer.add(paper['id'], cached[paper['pdf_sha256']])
+    print(f"Extraction cache: {hits} hits, {len(misses)} misses "
+          f"({time.perf_counter() - cache_start:.2f}s to load cached texts).")
+
+    if PREPROCESS_WORKERS > 1 and len(misses) > 1:
+        print(f"Extracting text with {PREPROCESS_WORKERS} worker processes.")
+        extracted = extract_texts_in_parallel(misses, pool)
+    else:
+        extracted = extract_texts_serially(misses)
+
+    for paper, document in extracted:
+        print(f"\nProcessed paper ID: {paper['id']} | File: '{paper['file_path']}'")
+        
+        if document and any(document['pages']):
+            pages = document['pages']
+            found = sorted({section for section, _, _ in document['sections']})
+            print(f"Extracted {sum(len(page) for page in pages)} characters from {len(pages)} pages. "
+                  f"Sections: {', '.join(found) if found else 'none detected'}.")
+            writer.add(paper['id'], document, paper['pdf_sha256'])
+        else:
+            print("No text could be extracted.")
+
+
+def watch_for_papers(db_conn, writer, stop_event, poll_seconds=WATCH_POLL_SECONDS):
+    """
+    Preprocesses papers as retrieval saves them. Polls papers1 until stop_event
+    is set, then makes one last pass and returns the number of papers handled.
+    Each paper is attempted once, so PDFs that yield no text are not retried.
+    One ExtractionPool serves every poll and is shut down on return.
+    """
+    attempted = set()
+    pool = ExtractionPool()
+    try:
+        while True:
+            finished = stop_event is None or stop_event.is_set()
+            # End the previous read transaction so this poll sees newly committed rows.
+            db_conn.commit()
+            papers = [paper for paper in get_papers_without_full_text(db_conn) if paper['id'] not in attempted]
+            if papers:
+                attempted.update(paper['id'] for paper in papers)
+                preprocess_papers(db_conn, writer, papers, pool)
+                writer.flush()
+            elif finished:
+                return len(attempted)
+            else:
+                stop_event.wait(poll_seconds)
+    finally:
+        pool.close()
+
+
+def run_preprocessing(watch=False, stop_event=None): 
+    """
+    Main entry point for the preprocessing agent. With watch=True it keeps
+    picking up newly saved papers until stop_event (a threading.Event) is set.
+    """
+    global db_connect_count
     print(f"\n{'='*25} EXECUTING AGENT: Preprocessing_agent.py {'='*25}")
     
+    db_connect_count = 0
     db_conn = get_db_connection()
     if not db_conn:
         return
 
     try:
-        papers_to_process = get_papers_without_full_text(db_conn)
-        
-        if not papers_to_process:
-            print("No new papers to preprocess.")
-            return
-
-        print(f"Found {len(papers_to_process)} papers to preprocess.")
-        for paper in papers_to_process:
-            print(f"\nProcessing paper ID: {paper['id']} | File: '{paper['file_path']}'")
+        writer = FullTextWriter(db_conn)
+        if watch:
+            print(f"Watching for new papers every {WATCH_POLL_SECONDS:g}s until retrieval finishes...")
+            with writer:
+                handled = watch_for_papers(db_conn, writer, stop_event)
+            if not handled:
+                print("No new papers to preprocess.")
+                return
+        else:
+            papers_to_process = get_papers_without_full_text(db_conn)
             
-            full_text = extract_text_from_pdf(paper['file_path'])
-            
-            if full_text:
-                print(f"Extracted {len(full_text)} characters.")
-                
-                update_conn = get_db_connection()
-                if update_conn:
-                    update_paper_with_full_text(update_conn, paper['id'], full_text)
-                    update_conn.close()
-            else:
-                print("No text could be extracted.")
+            if not papers_to_process:
+                print("No new papers to preprocess.")
+                return
+
+            with writer:
+                preprocess_papers(db_conn, writer, papers_to_process)
+        writer.report()
+        print_storage_stats(db_conn)
         
         print(f"\n SUCCESS: Agent 'Preprocessing_agent.py' completed.")
     finally:
         if db_conn and db_conn.is_connected():
             db_conn.close()
 
+def run_preprocessing_alongside(producer, name="producer"):
+    """
+    Runs producer() (e.g. retrieval) in a background thread while preprocessing
+    extracts papers as they are saved; re-raises the producer's exception.
+    """
+    producer_done = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            producer()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            producer_done.set()
+
+    producer_thread = threading.Thread(target=produce, name=name, daemon=True)
+    producer_thread.start()
+    try:
+        run_preprocessing(watch=True, stop_event=producer_done)
+    finally:
+        producer_thread.join()
+    if errors:
+        raise errors[0]
+
 
 
 if __name__ == '_main_':
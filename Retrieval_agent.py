@@ -1,6 +1,8 @@
 import mysql.connector
 from mysql.connector import Error
 import requests
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
 import xml.etree.ElementTree as ET
 import time
 import os
@@ -8,6 +10,16 @@ import sys
 import re 
 import random 
 import json 
+import io
+import threading
+import hashlib
+import unicodedata
+import tempfile
+import sqlite3
+from contextlib import closing
+from urllib.parse import urlparse, urlsplit, parse_qsl
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from Preprocessing_agent import extract_document_from_bytes, store_cached_documents
 
 DB_CONFIG = {
     'host': 'localhost',
@@ -16,12 +28,95 @@ DB_CONFIG = {
     'database': 'agentic_ai_db'
 }
 DOWNLOADS_DIR = 'downloads'
+# PDFs are stored once under their SHA-256 digest; the URL index lets later
+# runs skip downloads of URLs whose content is already in the store.
+PARTIAL_DOWNLOADS_DIR = os.path.join(DOWNLOADS_DIR, '.partial')
+PDF_URL_INDEX_PATH = os.path.join(DOWNLOADS_DIR, 'url_index.json')
+# Downloads are checked while streaming: the %PDF- signature must appear in
+# the first PDF_SIGNATURE_WINDOW bytes and the body may not exceed MAX_PDF_BYTES.
+MAX_PDF_BYTES = 100 * 1024 * 1024
+PDF_SIGNATURE_WINDOW = 1024
+
+# Fused mode parses each PDF from memory as soon as it is downloaded and stores
+# the result in the extraction cache, so preprocessing never re-reads it from
+# disk. FUSED_ARCHIVE_MODE 'async' still writes the PDF to the store on a
+# background thread; 'none' keeps no copy on disk.
+FUSED_EXTRACTION = False
+FUSED_ARCHIVE_MODE = 'async'
+# At most this many bytes of PDFs wait for the background archive writer;
+# past it, downloads write their archive copy synchronously.
+FUSED_ARCHIVE_MAX_QUEUED_BYTES = 256 * 1024 * 1024
+
+# When sources return the same paper, the copy from the source listed first
+# is kept (arXiv and publisher PDFs before repository scans); among copies from
+# the same source, the one with more complete metadata wins. A better copy can
+# replace a claim until that claim's paper row has been saved.
+SOURCE_PREFERENCE = ['arXiv', 'Semantic Scholar', 'CORE']
 
 LIMIT_ARXIV = 50     
 LIMIT_SEMANTIC = 25  
 LIMIT_CORE = 25       
 
 CORE_API_KEY = "YOUR_CORE_API_KEY" 
+SEMANTIC_SCHOLAR_API_KEY = ""
+
+# Semantic Scholar: bulk search returns up to 1000 ids per page (filtered to
+# papers with an open-access PDF); details are fetched with the batch
+# endpoint only for the ids that are actually needed.
+SEMANTIC_BULK_SORT = 'citationCount:desc'
+SEMANTIC_MAX_BULK_PAGES = 3
+SEMANTIC_BATCH_SIZE = 50
+SEMANTIC_MAX_RETRIES = 6
+
+# arXiv is searched page by page until LIMIT_ARXIV papers have downloaded.
+ARXIV_PAGE_SIZE = 100
+ARXIV_MAX_START = 10000
+
+# Concurrent download engine. Each host gets a token bucket of
+# (requests per second, burst) and its own download pool sized to its cap on
+# simultaneous connections, so a busy host never holds workers another host
+# could use.
+DEFAULT_HOST_RATE = (0.5, 2)
+HOST_RATE_LIMITS = {
+    'export.arxiv.org': (0.33, 1),
+    'arxiv.org': (1.0, 4),
+    'api.semanticscholar.org': (0.33, 1),
+    'api.core.ac.uk': (0.33, 1),
+    'core.ac.uk': (1.0, 2),
+}
+# Hosts whose rate adapts to observed 429s (AIMD): (min rate, max rate).
+ADAPTIVE_HOST_RATES = {
+    'api.semanticscholar.org': (0.1, 1.0),
+}
+AIMD_INCREASE = 0.05
+AIMD_DECREASE = 0.5
+DEFAULT_HOST_CONCURRENCY = 2
+HOST_CONCURRENCY = {
+    'arxiv.org': 4,
+    'core.ac.uk': 3,
+}
+
+# On-disk cache for search API responses. Fresh entries skip the network
+# entirely; stale ones are revalidated with ETag/Last-Modified when available.
+HTTP_CACHE_PATH = os.path.join('cache', 'http_cache.sqlite3')
+HTTP_CACHE_TTL = 24 * 60 * 60
+HTTP_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# One pooled session is shared by every search and download request.
+# Retries for connection errors, timeouts, 429 and 5xx responses use
+# jittered exponential back-off and honour Retry-After.
+HTTP_POOL_CONNECTIONS = 20
+HTTP_POOL_MAXSIZE = 8
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 2
+HTTP_BACKOFF_MAX = 60
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Paper metadata is written in batches with executemany; a batch is flushed
+# when it reaches PAPER_WRITE_BATCH_SIZE rows or PAPER_WRITE_FLUSH_SECONDS
+# after the previous flush, and always when a source finishes.
+PAPER_WRITE_BATCH_SIZE = 25
+PAPER_WRITE_FLUSH_SECONDS = 5.0
 
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -49,202 +144,1041 @@ def sanitize_filename(name):
     name = re.sub(r'[\\/*?:"<>|]', "_", name)
     return name[:150] 
 
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def on_success(self):
+        pass
+
+    def on_throttle(self, retry_after=None):
+        pass
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    # Additive increase after each successful request, multiplicative
+    # decrease on every 429. A Retry-After value pauses all callers.
+    def __init__(self, rate, capacity, min_rate, max_rate):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.blocked_until = 0.0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                pause = self.blocked_until - time.monotonic()
+            if pause <= 0:
+                break
+            time.sleep(pause)
+        super().acquire()
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + AIMD_INCREASE)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * AIMD_DECREASE)
+            self.tokens = min(self.tokens, 0)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            print(f"    Rate limited. Request rate lowered to {self.rate:.2f}/s.")
+
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+_archive_executor = None
+_archive_executor_lock = threading.Lock()
+_archive_queued_bytes = 0
+_archive_queued_lock = threading.Lock()
+_url_index = None
+_url_index_lock = threading.Lock()
+_run_digests = set()
+_run_digests_lock = threading.Lock()
+_download_rejections = []
+_download_rejections_lock = threading.Lock()
+
+def get_host_limits(url):
+    host = (urlparse(url).hostname or '').lower()
+    with _host_limits_lock:
+        if host not in _host_limits:
+            rate, burst = HOST_RATE_LIMITS.get(host, DEFAULT_HOST_RATE)
+            slots = HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+            if host in ADAPTIVE_HOST_RATES:
+                min_rate, max_rate = ADAPTIVE_HOST_RATES[host]
+                bucket = AdaptiveRateLimiter(rate, burst, min_rate, max_rate)
+            else:
+                bucket = TokenBucket(rate, burst)
+            executor = ThreadPoolExecutor(max_workers=slots, thread_name_prefix=f'pdf-{host or "unknown"}')
+            _host_limits[host] = (bucket, executor)
+        return _host_limits[host]
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(HEADERS)
+            _http_session = session
+        return _http_session
+
+def _backoff_delay(attempt):
+    delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def _retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def http_request(method, url, max_retries=HTTP_MAX_RETRIES, **kwargs):
+    # Every attempt waits for the host's token bucket. The final response is
+    # returned even if its status is an error, so callers decide how to react.
+    session = get_http_session()
+    host = urlparse(url).hostname
+    bucket, _ = get_host_limits(url)
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            wait_time = _backoff_delay(attempt)
+            print(f"    Request to {host} failed ({e.__class__.__name__}). Retrying in {wait_time:.1f} seconds... (Attempt {attempt + 1}/{max_retries})")
+        else:
+            retry_after = _retry_after_seconds(response)
+            if response.status_code == 429:
+                bucket.on_throttle(retry_after)
+            elif response.status_code < 500:
+                bucket.on_success()
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == max_retries:
+                return response
+            wait_time = min(retry_after, HTTP_BACKOFF_MAX * 2) if retry_after is not None else _backoff_delay(attempt)
+            response.close()
+            print(f"    {host} returned {response.status_code}. Retrying in {wait_time:.1f} seconds... (Attempt {attempt + 1}/{max_retries})")
+        time.sleep(wait_time)
+
+def get_http_pool_stats():
+    # urllib3 counts requests and newly opened connections per host pool;
+    # the difference is the number of requests that reused a connection.
+    stats = {}
+    for adapter in set(get_http_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host, {'requests': 0, 'connections': 0, 'reused': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+            host_stats['reused'] += max(pool.num_requests - pool.num_connections, 0)
+    return stats
+
+
+class CachedResponse:
+    def __init__(self, status_code, content, headers, from_cache):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+_http_cache_lock = threading.Lock()
+
+def _open_http_cache():
+    os.makedirs(os.path.dirname(HTTP_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(HTTP_CACHE_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            cache_key TEXT PRIMARY KEY,
+            url TEXT,
+            status_code INTEGER,
+            headers TEXT,
+            body BLOB,
+            etag TEXT,
+            last_modified TEXT,
+            stored_at REAL,
+            accessed_at REAL,
+            size INTEGER
+        )
+    """)
+    return conn
+
+def http_cache_key(method, url, params=None, json_body=None):
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(str(k), str(v)) for k, v in params.items()]
+    normalized = {
+        'method': method.upper(),
+        'url': f"{parts.scheme}://{parts.netloc.lower()}{parts.path}",
+        'params': sorted(query),
+        'body': json_body,
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _http_cache_get(cache_key):
+    try:
+        with _http_cache_lock, closing(_open_http_cache()) as conn:
+            return conn.execute(
+                "SELECT status_code, headers, body, etag, last_modified, stored_at FROM responses WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"    WARNING: HTTP cache read failed: {e}")
+        return None
+
+def _http_cache_touch(cache_key, refreshed=False):
+    now = time.time()
+    try:
+        with _http_cache_lock, closing(_open_http_cache()) as conn:
+            if refreshed:
+                conn.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE cache_key = ?", (now, now, cache_key))
+            else:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE cache_key = ?", (now, cache_key))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"    WARNING: HTTP cache update failed: {e}")
+
+def _http_cache_put(cache_key, url, response):
+    now = time.time()
+    body = response.content
+    try:
+        with _http_cache_lock, closing(_open_http_cache()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, url, response.status_code, json.dumps(dict(response.headers)), body,
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(body))
+            )
+            total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > HTTP_CACHE_MAX_BYTES:
+                evict_keys = []
+                for key, size in conn.execute("SELECT cache_key, size FROM responses ORDER BY accessed_at ASC"):
+                    if total_size <= HTTP_CACHE_MAX_BYTES:
+                        break
+                    evict_keys.append((key,))
+                    total_size -= size
+                conn.executemany("DELETE FROM responses WHERE cache_key = ?", evict_keys)
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"    WARNING: HTTP cache write failed: {e}")
+
+def cached_request(method, url, params=None, json_body=None, headers=None, timeout=30, ttl=HTTP_CACHE_TTL, max_retries=HTTP_MAX_RETRIES):
+    # Returns a CachedResponse; raises requests.exceptions.HTTPError on error
+    # statuses just like response.raise_for_status(). Only successful
+    # responses are cached, and host throttling only applies on a network call.
+    cache_key = http_cache_key(method, url, params, json_body)
+    entry = _http_cache_get(cache_key)
+    if entry:
+        status_code, cached_headers, body, etag, last_modified, stored_at = entry
+        if time.time() - stored_at < ttl:
+            _http_cache_touch(cache_key)
+            return CachedResponse(status_code, body, json.loads(cached_headers), from_cache=True)
+
+    req_headers = dict(headers or {})
+    if entry and etag:
+        req_headers['If-None-Match'] = etag
+    if entry and last_modified:
+        req_headers['If-Modified-Since'] = last_modified
+
+    response = http_request(method, url, max_retries=max_retries, params=params, json=json_body, headers=req_headers, timeout=timeout)
+    if entry and response.status_code == 304:
+        _http_cache_touch(cache_key, refreshed=True)
+        return CachedResponse(status_code, body, json.loads(cached_headers), from_cache=True)
+
+    response.raise_for_status()
+    _http_cache_put(cache_key, url, response)
+    return CachedResponse(response.status_code, response.content, dict(response.headers), from_cache=False)
+
+def get_store_path(digest):
+    return os.path.join(DOWNLOADS_DIR, f"{digest}.pdf")
+
+def _load_url_index():
+    global _url_index
+    if _url_index is None:
+        try:
+            with open(PDF_URL_INDEX_PATH, 'r', encoding='utf-8') as f:
+                _url_index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            _url_index = {}
+    return _url_index
+
+def lookup_stored_pdf(pdf_url):
+    with _url_index_lock:
+        digest = _load_url_index().get(pdf_url)
+    if digest and os.path.exists(get_store_path(digest)):
+        return digest
+    return None
+
+def record_stored_pdf(pdf_url, digest):
+    with _url_index_lock:
+        index = _load_url_index()
+        index[pdf_url] = digest
+        tmp_path = PDF_URL_INDEX_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, PDF_URL_INDEX_PATH)
+
+def claim_digest(digest):
+    # True the first time a digest is seen in this retrieval run, so the same
+    # PDF returned by two sources is only saved (and processed) once.
+    with _run_digests_lock:
+        if digest in _run_digests:
+            return False
+        _run_digests.add(digest)
+        return True
+
+def reset_run_digests():
+    with _run_digests_lock:
+        _run_digests.clear()
+
+def record_download_rejection(source, pdf_url, reason):
+    with _download_rejections_lock:
+        _download_rejections.append((source, pdf_url, reason))
+
+def get_download_rejections():
+    with _download_rejections_lock:
+        return list(_download_rejections)
+
+def reset_download_rejections():
+    with _download_rejections_lock:
+        _download_rejections.clear()
+
+def normalize_doi(doi):
+    if not doi:
+        return None
+    doi = doi.strip().lower()
+    doi = re.sub(r'^(https?://(dx\.)?doi\.org/|doi:)', '', doi)
+    return doi or None
+
+def normalize_arxiv_id(arxiv_id):
+    if not arxiv_id:
+        return None
+    arxiv_id = arxiv_id.strip().lower()
+    arxiv_id = re.sub(r'^(https?://arxiv\.org/(abs|pdf)/|arxiv:)', '', arxiv_id)
+    arxiv_id = re.sub(r'(\.pdf)?$', '', arxiv_id)
+    arxiv_id = re.sub(r'v\d+$', '', arxiv_id)
+    return arxiv_id or None
+
+def _first_author_surname(authors):
+    if isinstance(authors, str):
+        authors = authors.split(', ')
+    for name in authors or []:
+        if not name or name == 'Unknown Author':
+            continue
+        surname = name.split(',')[0] if ',' in name else name.split()[-1]
+        surname = re.sub(r'[^a-z]', '', unicodedata.normalize('NFKD', surname).lower())
+        if surname:
+            return surname
+    return ''
+
+def paper_identity_keys(paper_details):
+    keys = []
+    doi = normalize_doi(paper_details.get('doi'))
+    if doi:
+        keys.append(f"doi:{doi}")
+    arxiv_id = normalize_arxiv_id(paper_details.get('arxiv_id'))
+    if arxiv_id:
+        keys.append(f"arxiv:{arxiv_id}")
+    title = re.sub(r'[^a-z0-9]', '', unicodedata.normalize('NFKD', paper_details.get('title') or '').lower())
+    if len(title) >= 10:
+        keys.append(f"title:{title}:{_first_author_surname(paper_details.get('authors'))}")
+    return keys
+
+def copy_rank(paper_details, source):
+    # Lower is better: source preference first, then metadata completeness.
+    source_rank = SOURCE_PREFERENCE.index(source) if source in SOURCE_PREFERENCE else len(SOURCE_PREFERENCE)
+    fields = ('doi', 'arxiv_id', 'abstract', 'year', 'authors')
+    return source_rank, -sum(1 for field in fields if paper_details.get(field))
+
+
+class PaperDedupIndex:
+    # Shared by all sources of a retrieval run. A paper is claimed before its
+    # PDF is downloaded; a failed download releases the claim so a copy from
+    # another source can still be used. An unsaved claim is superseded by a
+    # better-ranked copy (see copy_rank) and kept as that copy's fallback: if
+    # the better copy's download fails, the best fallback is reinstated, and a
+    # fallback that already finished downloading is handed back for saving.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.claims = {}
+
+    def claim(self, keys, source, rank=(0, 0)):
+        with self.lock:
+            existing = []
+            for key in keys:
+                other = self.claims.get(key)
+                if other is not None and all(other is not c for c in existing):
+                    existing.append(other)
+            if any(c['saved'] or c['rank'] <= rank for c in existing):
+                return None
+            claim = {'source': source, 'keys': list(keys), 'saved': False, 'superseded': False,
+                     'rank': rank, 'fallbacks': [], 'winner': None, 'parked': None}
+            for old in existing:
+                self._unregister(old)
+                old['superseded'] = True
+                claim['fallbacks'] += [old] + old['fallbacks']
+                old['fallbacks'] = []
+            for fallback in claim['fallbacks']:
+                fallback['winner'] = claim
+            self._register(claim)
+            return claim
+
+    def _register(self, claim):
+        for key in claim['keys']:
+            self.claims.setdefault(key, claim)
+
+    def _unregister(self, claim):
+        for key in claim['keys']:
+            if self.claims.get(key) is claim:
+                del self.claims[key]
+
+    def release(self, claim):
+        # Returns the paper_details of a reinstated fallback that had already
+        # finished downloading (now marked saved), or None.
+        with self.lock:
+            if claim['saved']:
+                return None
+            if claim['superseded']:
+                claim['winner']['fallbacks'].remove(claim)
+                return None
+            self._unregister(claim)
+            if not claim['fallbacks']:
+                return None
+            best = min(claim['fallbacks'], key=lambda c: c['rank'])
+            best['fallbacks'] = [c for c in claim['fallbacks'] if c is not best]
+            for fallback in best['fallbacks']:
+                fallback['winner'] = best
+            best['superseded'] = False
+            best['winner'] = None
+            self._register(best)
+            if best['parked'] is None:
+                return None
+            best['saved'] = True
+            return best['parked']
+
+    def mark_saved(self, claim, paper_details=None):
+        # Returns False if a better copy superseded the claim meanwhile; the
+        # downloaded paper_details are then parked in case that copy fails.
+        with self.lock:
+            if claim['superseded']:
+                claim['parked'] = paper_details
+                return False
+            claim['saved'] = True
+            return True
+
+    def owner(self, keys):
+        with self.lock:
+            for key in keys:
+                if key in self.claims:
+                    return self.claims[key]['source']
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.claims.clear()
+
+
+paper_index = PaperDedupIndex()
+
+def load_existing_papers_into_index(connection):
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT title, authors, source, doi, arxiv_id FROM papers1")
+        for row in cursor.fetchall():
+            claim = paper_index.claim(paper_identity_keys(row), row['source'])
+            if claim:
+                paper_index.mark_saved(claim)
+    except Error as e:
+        print(f" WARNING: Could not load existing papers into the dedup index: {e}")
+    finally:
+        cursor.close()
+
 def download_pdf(pdf_url, filename, source):
+    # Returns (file_path, digest, document). document is the extracted text
+    # in fused mode and None otherwise; file_path is None if nothing is archived.
     if not pdf_url:
         print(f"    ({source}) No PDF URL provided. Skipping download.")
-        return None
+        return None, None, None
 
     if not filename.lower().endswith('.pdf'):
         filename += '.pdf'
 
-    filepath = os.path.join(DOWNLOADS_DIR, sanitize_filename(filename))
-    if os.path.exists(filepath):
-         base, ext = os.path.splitext(filename)
-         filename = f"{base}_{int(time.time())}{ext}"
-         filepath = os.path.join(DOWNLOADS_DIR, sanitize_filename(filename))
+    digest = lookup_stored_pdf(pdf_url)
+    if digest:
+        print(f"    ({source}) Already in store: {filename} ({digest[:12]})")
+        return get_store_path(digest), digest, None
 
-    max_retries = 3
-    delay = 5
+    return _fetch_pdf(pdf_url, filename, source)
 
-    for attempt in range(max_retries):
+class PdfValidationError(ValueError):
+    pass
+
+def _validated_chunks(response):
+    # Yields the body in chunks, raising PdfValidationError as soon as it
+    # cannot be a valid PDF (too large, or no %PDF- signature near the start).
+    head = b''
+    size = 0
+    for chunk in response.iter_content(chunk_size=8192):
+        size += len(chunk)
+        if size > MAX_PDF_BYTES:
+            raise PdfValidationError(f"larger than {MAX_PDF_BYTES} bytes")
+        if len(head) < PDF_SIGNATURE_WINDOW:
+            head += chunk[:PDF_SIGNATURE_WINDOW - len(head)]
+            if len(head) >= PDF_SIGNATURE_WINDOW and b'%PDF-' not in head:
+                raise PdfValidationError(f"missing %PDF- signature (starts with {head[:16]!r})")
+        yield chunk
+    if b'%PDF-' not in head:
+        raise PdfValidationError(f"missing %PDF- signature (starts with {head[:16]!r})")
+
+def _store_pdf_stream(response):
+    # Streams the body to a partial file while hashing it, then moves it into
+    # the store under its digest (or drops it if that content is already stored).
+    os.makedirs(PARTIAL_DOWNLOADS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=PARTIAL_DOWNLOADS_DIR)
+    hasher = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in _validated_chunks(response):
+                hasher.update(chunk)
+                f.write(chunk)
+        digest = hasher.hexdigest()
+        filepath = get_store_path(digest)
+        already_stored = os.path.exists(filepath)
+        if not already_stored:
+            os.replace(tmp_path, filepath)
+        return filepath, digest, already_stored
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _read_pdf_stream(response):
+    # Fused mode: keeps the validated body in memory instead of writing it out.
+    data = bytearray()
+    hasher = hashlib.sha256()
+    for chunk in _validated_chunks(response):
+        hasher.update(chunk)
+        data += chunk
+    return bytes(data), hasher.hexdigest()
+
+def get_archive_executor():
+    global _archive_executor
+    with _archive_executor_lock:
+        if _archive_executor is None:
+            _archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-archive')
+        return _archive_executor
+
+def _archive_pdf(pdf_url, data, digest):
+    filepath = get_store_path(digest)
+    if not os.path.exists(filepath):
+        os.makedirs(PARTIAL_DOWNLOADS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=PARTIAL_DOWNLOADS_DIR)
         try:
-            time.sleep(random.uniform(3, 6))
-            
-            with requests.Session() as s:
-                response = s.get(pdf_url, stream=True, timeout=30, allow_redirects=True, headers=HEADERS) 
-                response.raise_for_status()
-                content_type = response.headers.get("Content-Type", "").lower()
-
-                is_likely_pdf = (
-                    "application/pdf" in content_type or
-                    ("application/octet-stream" in content_type and filename.lower().endswith('.pdf'))
-                )
-
-                if is_likely_pdf:
-                    with open(filepath, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    print(f"    ({source}) Downloaded: {filename}")
-                    try:
-                        if os.path.getsize(filepath) < 1024:
-                            print(f"    ({source}) WARNING: Downloaded file size < 1KB. Possible error page.")
-                    except OSError as e:
-                        print(f"    ({source}) WARNING: Could not get file size after download: {e}")
-                    return filepath
-                else:
-                    print(f"    ({source}) Link content type ('{content_type}') not PDF/octet-stream. Skipping.")
-                    return None
-        except requests.exceptions.Timeout:
-            print(f"    ({source}) Attempt {attempt + 1}/{max_retries} timed out for {filename}.")
-        except requests.exceptions.RequestException as e:
-            print(f"    ({source}) Attempt {attempt + 1}/{max_retries} failed for {filename}. Reason: {e}")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    record_stored_pdf(pdf_url, digest)
+
+def _queue_archive(pdf_url, data, digest):
+    # Hands the PDF to the background writer unless its backlog is full, in
+    # which case this download thread writes it itself.
+    global _archive_queued_bytes
+    with _archive_queued_lock:
+        queued = _archive_queued_bytes + len(data) <= FUSED_ARCHIVE_MAX_QUEUED_BYTES
+        if queued:
+            _archive_queued_bytes += len(data)
+    if not queued:
+        _archive_pdf(pdf_url, data, digest)
+        return
+
+    def release(_):
+        global _archive_queued_bytes
+        with _archive_queued_lock:
+            _archive_queued_bytes -= len(data)
+
+    get_archive_executor().submit(_archive_pdf, pdf_url, data, digest).add_done_callback(release)
+
+def drain_pdf_archive():
+    # Waits for background archive writes started in fused mode.
+    global _archive_executor
+    with _archive_executor_lock:
+        executor, _archive_executor = _archive_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def _extract_fetched_pdf(pdf_url, filename, source, data, digest):
+    # Fused mode: parses the in-memory PDF and schedules (or skips) the archive copy.
+    # A PDF that fails to parse has no cache entry, so preprocessing must read it
+    # from the store; it is then archived before the row can be saved.
+    document = extract_document_from_bytes(data, filename)
+    if document is not None:
+        print(f"    ({source}) Downloaded and extracted in memory: {filename} ({digest[:12]}, {len(document['pages'])} pages)")
+    if FUSED_ARCHIVE_MODE == 'none':
+        if document is None:
+            record_download_rejection(source, pdf_url, "could not be parsed in memory")
+            return None, None, None
+        return None, digest, document
+    if document is None:
+        try:
+            _archive_pdf(pdf_url, data, digest)
+        except OSError as e:
+            print(f"    ({source}) Could not archive {filename}: {e}")
+            record_download_rejection(source, pdf_url, "could not be parsed in memory or archived")
+            return None, None, None
+        print(f"    ({source}) Downloaded: {filename} ({digest[:12]}, archived for extraction from disk)")
+        return get_store_path(digest), digest, None
+    _queue_archive(pdf_url, data, digest)
+    return get_store_path(digest), digest, document
+
+def _fetch_pdf(pdf_url, filename, source):
+    try:
+        with http_request('GET', pdf_url, stream=True, timeout=30, allow_redirects=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").lower()
+
+            # The signature check is authoritative; only bodies that announce
+            # themselves as text are rejected before reading any of them.
+            if content_type.startswith(("text/", "application/xhtml", "application/json")):
+                reason = f"content type '{content_type}'"
+                print(f"    ({source}) Link content type ('{content_type}') is not a PDF. Skipping.")
+                record_download_rejection(source, pdf_url, reason)
+                return None, None, None
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > MAX_PDF_BYTES:
+                reason = f"Content-Length {content_length} exceeds {MAX_PDF_BYTES} bytes"
+                print(f"    ({source}) Rejected {filename}: {reason}.")
+                record_download_rejection(source, pdf_url, reason)
+                return None, None, None
+
+            if FUSED_EXTRACTION:
+                data, digest = _read_pdf_stream(response)
+            else:
+                filepath, digest, already_stored = _store_pdf_stream(response)
+    except PdfValidationError as e:
+        print(f"    ({source}) Rejected {filename}: {e}. Download aborted.")
+        record_download_rejection(source, pdf_url, str(e))
+        return None, None, None
+    except requests.exceptions.RequestException as e:
+        print(f"    ({source}) Download failed for {filename}. Reason: {e}")
+        return None, None, None
+
+    if FUSED_EXTRACTION:
+        if len(data) < 1024:
+            print(f"    ({source}) WARNING: Downloaded file size < 1KB. Possible error page.")
+        return _extract_fetched_pdf(pdf_url, filename, source, data, digest)
+
+    record_stored_pdf(pdf_url, digest)
+    if already_stored:
+        print(f"    ({source}) Downloaded: {filename} (identical copy already in store: {digest[:12]})")
+    else:
+        print(f"    ({source}) Downloaded: {filename} ({digest[:12]})")
+    try:
+        if os.path.getsize(filepath) < 1024:
+            print(f"    ({source}) WARNING: Downloaded file size < 1KB. Possible error page.")
+    except OSError as e:
+        print(f"    ({source}) WARNING: Could not get file size after download: {e}")
+    return filepath, digest, None
+
+def submit_download(pdf_url, filename, source):
+    # Queued on the PDF host's own pool, which waits only on that host's limits.
+    _, executor = get_host_limits(pdf_url or '')
+    return executor.submit(download_pdf, pdf_url, filename, source)
+
+def download_and_save_papers(db_conn, candidates, total_results, source):
+    with PaperWriter(db_conn, source) as writer:
+        return _download_and_queue_papers(writer, candidates, total_results, source)
+
+def _download_and_queue_papers(writer, candidates, total_results, source):
+    # candidates yields (pdf_url, filename, paper_details); only as many downloads
+    # as are still needed to reach total_results are kept in flight at once.
+    candidates = iter(candidates)
+    pending = {}
+    saved = 0
+    exhausted = False
+
+    while True:
+        while not exhausted and saved + len(pending) < total_results:
+            candidate = next(candidates, None)
+            if candidate is None:
+                exhausted = True
+                break
+            pdf_url, filename, paper_details = candidate
+            keys = paper_identity_keys(paper_details)
+            claim = paper_index.claim(keys, source, copy_rank(paper_details, source))
+            if claim is None:
+                print(f"    ({source}) Already retrieved via {paper_index.owner(keys)}. Skipping: {paper_details['title'][:60]}...")
+                continue
+            pending[submit_download(pdf_url, filename, source)] = (paper_details, claim)
+
+        if not pending:
+            break
+
+        done, _ = wait(pending, timeout=writer.flush_interval, return_when=FIRST_COMPLETED)
+        writer.flush_if_due()
+        for future in done:
+            paper_details, claim = pending.pop(future)
+            try:
+                file_path, digest, document = future.result()
+            except Exception as e:
+                print(f"    ({source}) Download failed for '{paper_details['title'][:60]}': {e}")
+                file_path, digest, document = None, None, None
+
+            if not digest:
+                fallback = paper_index.release(claim)
+                if fallback is not None:
+                    print(f"    ({source}) Using the {fallback['source']} copy instead: {fallback['title'][:60]}...")
+                    _queue_paper(writer, fallback, source)
+                continue
+
+            paper_details['file_path'] = file_path
+            paper_details['pdf_sha256'] = digest
+            paper_details['document'] = document
+            if not paper_index.mark_saved(claim, paper_details):
+                print(f"    ({source}) A better copy from another source is pending; keeping this one as fallback: {paper_details['title'][:60]}...")
+                continue
+            saved += _queue_paper(writer, paper_details, source)
+
+    return saved
+
+def _queue_paper(writer, paper_details, source):
+    if not claim_digest(paper_details['pdf_sha256']):
+        print(f"    ({source}) Same PDF already saved in this run. Skipping: {paper_details['title'][:60]}...")
+        return 0
+    writer.add(paper_details)
+    return 1
+
+SAVE_PAPER_QUERY = """
+    INSERT INTO papers1 (title, authors, publication_year, source, source_url, abstract, file_path, pdf_sha256, doi, arxiv_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE title=VALUES(title)
+"""
+
+def paper_to_row(paper_details):
+    authors_str = ', '.join(paper_details.get('authors', [])) if isinstance(paper_details.get('authors'), list) else paper_details.get('authors', '')
+    abstract_short = (paper_details.get('abstract') or '')[:65530]
+    return (
+        paper_details['title'],
+        authors_str,
+        paper_details.get('year'),
+        paper_details['source'],
+        paper_details['url'],
+        abstract_short,
+        paper_details.get('file_path'),
+        paper_details.get('pdf_sha256'),
+        normalize_doi(paper_details.get('doi')),
+        normalize_arxiv_id(paper_details.get('arxiv_id'))
+    )
+
 
-        if attempt < max_retries - 1:
-            print(f"        Retrying in {delay} seconds...")
-            time.sleep(delay)
-            delay *= 2
+class PaperWriter:
+    # Buffers paper rows for one connection and writes them with executemany.
+    # If a batch fails, its rows are retried one by one so a single bad row
+    # does not lose the rest of the batch. Documents extracted in fused mode
+    # go to the extraction cache in the same transaction as the paper rows.
+    def __init__(self, connection, source, batch_size=PAPER_WRITE_BATCH_SIZE, flush_interval=PAPER_WRITE_FLUSH_SECONDS):
+        self.connection = connection
+        self.source = source
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.documents = []
+        self.last_flush = time.monotonic()
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        if self.flushes:
+            print(f" ({self.source}) Wrote {self.rows_written} paper rows in {self.flushes} batches "
+                  f"(avg flush {self.flush_seconds / self.flushes * 1000:.1f} ms, total {self.flush_seconds * 1000:.1f} ms).")
+
+    def add(self, paper_details):
+        self.rows.append(paper_to_row(paper_details))
+        if paper_details.get('document') is not None:
+            self.documents.append((paper_details['pdf_sha256'], paper_details['document']))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
         else:
-            print(f"    ({source}) All retries failed for {filename}.")
-            return None
-    return None
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.rows and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        documents, self.documents = self.documents, []
+        start_time = time.perf_counter()
+        written = self._write_batch(rows, documents)
+        elapsed = time.perf_counter() - start_time
+        self.rows_written += written
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        print(f" ({self.source}) Saved metadata for {written}/{len(rows)} papers in {elapsed * 1000:.1f} ms.")
+
+    def _write_batch(self, rows, documents=()):
+        cursor = self.connection.cursor()
+        try:
+            if documents:
+                store_cached_documents(cursor, documents)
+            cursor.executemany(SAVE_PAPER_QUERY, rows)
+            self.connection.commit()
+            return len(rows)
+        except Error as e:
+            print(f"Error saving batch of {len(rows)} papers to DB: {e}. Retrying row by row.")
+            self.connection.rollback()
+        finally:
+            cursor.close()
+
+        if documents:
+            cursor = self.connection.cursor()
+            try:
+                store_cached_documents(cursor, documents)
+                self.connection.commit()
+            except Error as e:
+                print(f"Error saving {len(documents)} extracted documents to the cache: {e}")
+                self.connection.rollback()
+            finally:
+                cursor.close()
+
+        written = 0
+        for row in rows:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(SAVE_PAPER_QUERY, row)
+                self.connection.commit()
+                written += 1
+            except Error as e:
+                print(f"Error saving paper to DB: {e} ({row[0][:60]}...)")
+                self.connection.rollback()
+            finally:
+                cursor.close()
+        return written
+
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+ARXIV_NS = '{http://arxiv.org/schemas/atom}'
+
+def _arxiv_entry_to_candidate(entry):
+    url = entry.find(f'{ATOM_NS}id').text
+    pdf_url = url.replace('/abs/', '/pdf/') + '.pdf'
+    record_id_part = url.split('/abs/')[-1].replace('/', '_')
+    title_part = sanitize_filename(entry.find(f'{ATOM_NS}title').text.strip())[:50]
+    filename = f"arXiv_{record_id_part}_{title_part}.pdf"
 
-def save_paper_to_db(connection, paper_details):
-    cursor = connection.cursor()
-    query = """
-        INSERT INTO papers1 (title, authors, publication_year, source, source_url, abstract, file_path)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE title=VALUES(title);
-    """
+    paper_details = {
+        'title': entry.find(f'{ATOM_NS}title').text.strip(),
+        'url': url,
+        'authors': [a.find(f'{ATOM_NS}name').text for a in entry.findall(f'{ATOM_NS}author')],
+        'abstract': entry.find(f'{ATOM_NS}summary').text.strip(),
+        'year': safe_to_int(entry.find(f'{ATOM_NS}published').text),
+        'source': 'arXiv',
+        'arxiv_id': url.split('/abs/')[-1],
+        'doi': entry.findtext(f'{ARXIV_NS}doi')
+    }
+    return pdf_url, filename, paper_details
+
+def parse_arxiv_entries(content):
+    # Each <entry> is handed out as soon as it has been parsed and then
+    # cleared, so a large page is never held as a full element tree.
+    for _, element in ET.iterparse(io.BytesIO(content), events=('end',)):
+        if element.tag == f'{ATOM_NS}entry':
+            yield _arxiv_entry_to_candidate(element)
+            element.clear()
+
+def fetch_arxiv_page(query, start, page_size):
+    base_url = 'http://export.arxiv.org/api/query?'
+    search_query = f'search_query=all:{query.replace(" ", "+")}&start={start}&max_results={page_size}'
+    print(f"    (arXiv) Requesting results {start}-{start + page_size}...")
+    response = cached_request('GET', base_url + search_query, timeout=30)
+    if response.from_cache:
+        print(f"    (arXiv) Using cached search results for page starting at {start}.")
+    return response
+
+def arxiv_candidates(query, total_results):
+    # The next page is requested in the background as soon as the current one
+    # arrives, so it is ready by the time its downloads have been queued.
+    page_size = min(ARXIV_PAGE_SIZE, max(int(total_results * 1.5), 10))
+    page_fetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='arxiv-pages')
+    start = 0
+    next_page = page_fetcher.submit(fetch_arxiv_page, query, start, page_size)
     try:
-        authors_str = ', '.join(paper_details.get('authors', [])) if isinstance(paper_details.get('authors'), list) else paper_details.get('authors', '')
-        abstract_short = paper_details.get('abstract', '')[:65530]
-
-        cursor.execute(query, (
-            paper_details['title'],
-            authors_str,
-            paper_details.get('year'),
-            paper_details['source'],
-            paper_details['url'],
-            abstract_short,
-            paper_details.get('file_path')
-        ))
-        connection.commit()
-        print(f" ({paper_details['source']}) Saved metadata: {paper_details['title'][:60]}...")
-    except Error as e:
-        print(f"Error saving paper to DB: {e}")
+        while next_page is not None:
+            try:
+                response = next_page.result()
+            except requests.exceptions.RequestException as e:
+                print(f"   (arXiv) Error requesting page at {start}: {e}")
+                return
+
+            start += page_size
+            next_page = None
+            if start < ARXIV_MAX_START:
+                next_page = page_fetcher.submit(fetch_arxiv_page, query, start, page_size)
+
+            entries = 0
+            try:
+                for candidate in parse_arxiv_entries(response.content):
+                    entries += 1
+                    yield candidate
+            except ET.ParseError as e:
+                print(f"   (arXiv) Error parsing page at {start - page_size}: {e}")
+                return
+
+            if entries < page_size:
+                print("    (arXiv) No more results found from the API.")
+                return
     finally:
-        cursor.close()
+        page_fetcher.shutdown(wait=False, cancel_futures=True)
 
 
 def retrieve_papers_from_arxiv(db_conn, query, total_results):
     print(f"\n  Searching arXiv API for {total_results} papers on: '{query}'...")
-    base_url = 'http://export.arxiv.org/api/query?'
-    search_query = f'search_query=all:{query.replace(" ", "+")}&start=0&max_results={int(total_results * 1.5)}'
+    candidates = arxiv_candidates(query, total_results)
+    papers_processed = download_and_save_papers(db_conn, candidates, total_results, 'arXiv')
+    print(f"\n  (arXiv) Successfully processed {papers_processed} papers.")
 
-    papers_processed = 0
-    try:
-        time.sleep(random.uniform(2, 4))
+
+SEMANTIC_SCHOLAR_FIELDS = "title,authors,year,abstract,url,openAccessPdf,paperId,externalIds"
+
+def semantic_scholar_request(method, url, params=None, json_body=None):
+    headers = {"x-api-key": SEMANTIC_SCHOLAR_API_KEY} if SEMANTIC_SCHOLAR_API_KEY else None
+    return cached_request(method, url, params=params, json_body=json_body, headers=headers,
+                          timeout=30, max_retries=SEMANTIC_MAX_RETRIES)
+
+def _semantic_scholar_candidate(paper):
+    open_access_pdf_info = paper.get('openAccessPdf')
+    if not open_access_pdf_info or not open_access_pdf_info.get('url'):
+        return None
+
+    pdf_url = open_access_pdf_info['url']
+    paper_id = paper.get('paperId') or 'unknown_id'
+    title_part = sanitize_filename(paper.get('title') or 'NoTitle')[:50]
+    filename = f"SemanticScholar_{paper_id[:10]}_{title_part}.pdf"
+
+    authors_list = [
+        author.get('name', 'Unknown Author') 
+        for author in paper.get('authors') or [] 
+        if author and author.get('name')
+    ]
+    if not authors_list:
+        authors_list = ['Unknown Author']
         
-        response = requests.get(base_url + search_query, timeout=30, headers=HEADERS)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        atom_ns = '{http://www.w3.org/2005/Atom}'
-
-        for entry in root.findall(f'{atom_ns}entry'):
-            if papers_processed >= total_results: break
-            url = entry.find(f'{atom_ns}id').text
-            pdf_url = url.replace('/abs/', '/pdf/') + '.pdf'
-            record_id_part = url.split('/abs/')[-1].replace('/', '_')
-            title_part = sanitize_filename(entry.find(f'{atom_ns}title').text.strip())[:50]
-            filename = f"arXiv_{record_id_part}_{title_part}.pdf"
-
-            file_path = download_pdf(pdf_url, filename, 'arXiv')
-            if file_path:
-                paper_details = {
-                    'title': entry.find(f'{atom_ns}title').text.strip(),
-                    'url': url,
-                    'authors': [a.find(f'{atom_ns}name').text for a in entry.findall(f'{atom_ns}author')],
-                    'abstract': entry.find(f'{atom_ns}summary').text.strip(),
-                    'year': safe_to_int(entry.find(f'{atom_ns}published').text),
-                    'source': 'arXiv',
-                    'file_path': file_path
-                }
-                save_paper_to_db(db_conn, paper_details)
-                papers_processed += 1
-        print(f"\n  (arXiv) Successfully processed {papers_processed} papers.")
-    except (requests.exceptions.RequestException, ET.ParseError) as e: 
-        print(f"   (arXiv) Error processing arXiv batch: {e}")
+    external_ids = paper.get('externalIds') or {}
+    paper_details = {
+        'title': paper.get('title'), 'url': paper.get('url'),
+        'authors': authors_list,
+        'abstract': paper.get('abstract'), 'year': paper.get('year'),
+        'source': 'Semantic Scholar',
+        'doi': external_ids.get('DOI'), 'arxiv_id': external_ids.get('ArXiv')
+    }
+    return pdf_url, filename, paper_details
 
+def semantic_scholar_candidates(query):
+    # Bulk search only returns ids of papers with an open-access PDF; full
+    # details are looked up in batches as the download loop asks for more.
+    bulk_url = "https://api.semanticscholar.org/graph/v1/paper/search/bulk"
+    batch_url = "https://api.semanticscholar.org/graph/v1/paper/batch"
+    token = None
 
-def retrieve_papers_from_semantic_scholar(db_conn, query, total_results):
-    print(f"\n  Searching Semantic Scholar for {total_results} downloadable papers on: '{query}'...")
-    api_url = "https://api.semanticscholar.org/graph/v1/paper/search"
-
-    papers_found = 0
-    offset = 0
-    max_offset = 100 
-
-    while papers_found < total_results and offset < max_offset:
-        params = {
-            "query": query, "limit": 10, "offset": offset,
-            "fields": "title,authors,year,abstract,url,isOpenAccess,openAccessPdf,paperId"
-        }
-        response = None
+    for page in range(SEMANTIC_MAX_BULK_PAGES):
+        params = {"query": query, "fields": "paperId", "openAccessPdf": "", "sort": SEMANTIC_BULK_SORT}
+        if token:
+            params["token"] = token
         try:
-            print(f"    (Semantic Scholar) Requesting papers, offset: {offset}...")
-            time.sleep(random.uniform(3, 6)) 
-            response = requests.get(api_url, params=params, timeout=30, headers=HEADERS)
-            response.raise_for_status()
-            
-            data = response.json().get('data', [])
-            if not data:
-                print("    (Semantic Scholar) No more results found from the API.")
-                break
-
-            for paper in data:
-                if papers_found >= total_results: break
-
-                open_access_pdf_info = paper.get('openAccessPdf')
-                if paper.get('isOpenAccess') and open_access_pdf_info and open_access_pdf_info.get('url'):
-                    pdf_url = open_access_pdf_info['url']
-                    paper_id = paper.get('paperId', 'unknown_id')
-                    title_part = sanitize_filename(paper.get('title', 'NoTitle'))[:50]
-                    filename = f"SemanticScholar_{paper_id[:10]}_{title_part}.pdf"
-
-                    file_path = download_pdf(pdf_url, filename, 'Semantic Scholar')
-                    if file_path:
-                        authors_list = [
-                            author.get('name', 'Unknown Author') 
-                            for author in paper.get('authors', []) 
-                            if author and author.get('name')
-                        ]
-                        if not authors_list:
-                            authors_list = ['Unknown Author']
-                            
-                        paper_details = {
-                            'title': paper.get('title'), 'url': paper.get('url'),
-                            'authors': authors_list,
-                            'abstract': paper.get('abstract'), 'year': paper.get('year'),
-                            'source': 'Semantic Scholar', 'file_path': file_path
-                        }
-                        save_paper_to_db(db_conn, paper_details)
-                        papers_found += 1
-                        
+            print(f"    (Semantic Scholar) Requesting bulk search page {page + 1}...")
+            response = semantic_scholar_request('GET', bulk_url, params=params)
+            data = response.json()
         except requests.exceptions.RequestException as e:
-            print(f"     (Semantic Scholar) Error processing batch: {e}")
-            status_code = getattr(e.response, 'status_code', None)
-            if status_code == 429:
-                wait_time = random.uniform(60, 120)
-                print(f"    (Semantic Scholar) Rate limit hit (429). Waiting {wait_time:.0f} seconds...")
-                time.sleep(wait_time)
+            print(f"     (Semantic Scholar) Error during bulk search: {e}")
+            return
         except json.JSONDecodeError as e:
             print(f"     (Semantic Scholar) JSON Error: {e}")
-        except Exception as e:
-            print(f"     (Semantic Scholar) Error: {e}")
-            break
-         
-        offset += 10 
-        
+            return
+
+        paper_ids = [paper['paperId'] for paper in data.get('data') or [] if paper.get('paperId')]
+        if not paper_ids:
+            print("    (Semantic Scholar) No more results found from the API.")
+            return
+        print(f"    (Semantic Scholar) Bulk search returned {len(paper_ids)} open-access papers (of {data.get('total', '?')} total).")
+
+        for i in range(0, len(paper_ids), SEMANTIC_BATCH_SIZE):
+            batch_ids = paper_ids[i:i + SEMANTIC_BATCH_SIZE]
+            try:
+                response = semantic_scholar_request('POST', batch_url, params={"fields": SEMANTIC_SCHOLAR_FIELDS},
+                                                    json_body={"ids": batch_ids})
+                papers = response.json()
+            except requests.exceptions.RequestException as e:
+                print(f"     (Semantic Scholar) Error during batch lookup: {e}")
+                continue
+            except json.JSONDecodeError as e:
+                print(f"     (Semantic Scholar) JSON Error: {e}")
+                continue
+
+            for paper in papers:
+                candidate = _semantic_scholar_candidate(paper) if paper else None
+                if candidate:
+                    yield candidate
+
+        token = data.get('token')
+        if not token:
+            return
+
+
+def retrieve_papers_from_semantic_scholar(db_conn, query, total_results):
+    print(f"\n  Searching Semantic Scholar for {total_results} downloadable papers on: '{query}'...")
+    candidates = semantic_scholar_candidates(query)
+    papers_found = download_and_save_papers(db_conn, candidates, total_results, 'Semantic Scholar')
     print(f"\n  (Semantic Scholar) Successfully processed {papers_found} papers.")
 
 
@@ -267,13 +1201,11 @@ def retrieve_papers_from_core(db_conn, query, total_results):
     }
 
     papers_processed = 0
-    response = None
     try:
         print("    (CORE) Requesting results...")
-        time.sleep(random.uniform(3, 6))
-        
-        response = requests.post(search_url, json=payload, headers=req_headers, timeout=45)
-        response.raise_for_status()
+        response = cached_request('POST', search_url, json_body=payload, headers=req_headers, timeout=45)
+        if response.from_cache:
+            print("    (CORE) Using cached search results.")
         data = response.json()
 
         results = data.get('results', [])
@@ -283,10 +1215,8 @@ def retrieve_papers_from_core(db_conn, query, total_results):
             print("    (CORE) No matching records found.")
             return
 
+        candidates = []
         for work in results:
-            if papers_processed >= total_results:
-                break
-
             title = work.get('title', 'No Title Available')
             pdf_url = work.get('downloadUrl')
 
@@ -298,72 +1228,106 @@ def retrieve_papers_from_core(db_conn, query, total_results):
             title_part = sanitize_filename(title)[:50]
             filename = f"CORE_{core_id}_{title_part}.pdf"
 
-            file_path = download_pdf(pdf_url, filename, 'CORE')
-
-            if file_path:
-                authors_list = work.get('authors', [])
-                abstract = work.get('abstract', 'No Abstract Available')
-                year = safe_to_int(work.get('yearPublished') or work.get('publishedDate'))
-                source_url = f"https://core.ac.uk/work/{core_id}" if core_id_val is not None else work.get('doiUrl', '')
-
-                paper_details = {
-                    'title': title,
-                    'url': source_url,
-                    'authors': authors_list,
-                    'abstract': abstract,
-                    'year': year,
-                    'source': 'CORE',
-                    'file_path': file_path
-                }
-                save_paper_to_db(db_conn, paper_details)
-                papers_processed += 1
+            authors_list = [
+                author.get('name') if isinstance(author, dict) else author
+                for author in work.get('authors') or []
+            ]
+            authors_list = [name for name in authors_list if name]
+            abstract = work.get('abstract', 'No Abstract Available')
+            year = safe_to_int(work.get('yearPublished') or work.get('publishedDate'))
+            source_url = f"https://core.ac.uk/work/{core_id}" if core_id_val is not None else work.get('doiUrl', '')
+
+            paper_details = {
+                'title': title,
+                'url': source_url,
+                'authors': authors_list,
+                'abstract': abstract,
+                'year': year,
+                'source': 'CORE',
+                'doi': work.get('doi'),
+                'arxiv_id': work.get('arxivId')
+            }
+            candidates.append((pdf_url, filename, paper_details))
+
+        papers_processed = download_and_save_papers(db_conn, candidates, total_results, 'CORE')
 
     except requests.exceptions.RequestException as e:
         print(f"   (CORE) Error during API request: {e}")
-        if response is not None:
-            print(f"     Response content: {response.text[:500]}")
+        error_response = getattr(e, 'response', None)
+        if error_response is not None:
+            print(f"     Response content: {error_response.text[:500]}")
     except Exception as e:
         print(f"   (CORE) An unexpected error occurred: {e}")
 
     print(f"\n  (CORE) Successfully processed {papers_processed} papers with download URLs.")
 
 
-def run_retrieval(search_topic):
-    print(f"\n{'='*25} EXECUTING AGENT: retrieval_agent.py {'='*25}")
+def run_source_retrieval(source, retrieve_fn, search_topic, total_results):
+    # Each source runs on its own thread with its own connection; mysql
+    # connections must not be shared between threads.
+    start_time = time.time()
     db_conn = get_db_connection()
-    
     if not db_conn:
-        return
+        print(f" ({source}) Could not connect to the database. Skipping this source.")
+        return time.time() - start_time
+
+    try:
+        retrieve_fn(db_conn, search_topic, total_results=total_results)
+    except Exception as e:
+        print(f" ({source}) A critical error occurred: {e}")
+    finally:
+        if db_conn.is_connected():
+            db_conn.close()
+    return time.time() - start_time
+
+
+def run_retrieval(search_topic):
+    print(f"\n{'='*25} EXECUTING AGENT: retrieval_agent.py {'='*25}")
+    sources = [
+        ('arXiv', retrieve_papers_from_arxiv, LIMIT_ARXIV),
+        ('Semantic Scholar', retrieve_papers_from_semantic_scholar, LIMIT_SEMANTIC),
+        ('CORE', retrieve_papers_from_core, LIMIT_CORE),
+    ]
 
     try:
         if not os.path.exists(DOWNLOADS_DIR):
             os.makedirs(DOWNLOADS_DIR)
             print(f"Created directory: {DOWNLOADS_DIR}")
 
-        try:
-            retrieve_papers_from_arxiv(db_conn, search_topic, total_results=LIMIT_ARXIV)
-        except Exception as e:
-            print(f" (arXiv) A critical error occurred: {e}")
-
-        try:
-            retrieve_papers_from_semantic_scholar(db_conn, search_topic, total_results=LIMIT_SEMANTIC)
-        except Exception as e:
-            print(f" (Semantic Scholar) A critical error occurred: {e}")
+        reset_run_digests()
+        reset_download_rejections()
+        paper_index.clear()
+        seed_conn = get_db_connection()
+        if seed_conn:
+            load_existing_papers_into_index(seed_conn)
+            seed_conn.close()
 
-        try:
-            retrieve_papers_from_core(db_conn, search_topic, total_results=LIMIT_CORE)
-        except Exception as e:
-            print(f" (CORE) A critical error occurred: {e}")
+        stage_start = time.time()
+        with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix='retrieval') as executor:
+            futures = {
+                source: executor.submit(run_source_retrieval, source, retrieve_fn, search_topic, limit)
+                for source, retrieve_fn, limit in sources
+            }
+            source_times = {source: future.result() for source, future in futures.items()}
+        drain_pdf_archive()
         
         print("\nRetrieval process completed for all specified sources.")
+        for source, elapsed in source_times.items():
+            print(f"   - {source}: {elapsed:.2f} seconds")
+        print(f"   Total retrieval time: {time.time() - stage_start:.2f} seconds")
+
+        print("\nHTTP connection pool usage:")
+        for host, host_stats in sorted(get_http_pool_stats().items()):
+            print(f"   - {host}: {host_stats['requests']} requests, {host_stats['connections']} connections opened, {host_stats['reused']} reused")
+
+        rejections = get_download_rejections()
+        if rejections:
+            print(f"\nRejected {len(rejections)} downloads that were not valid PDFs:")
+            for source, pdf_url, reason in rejections:
+                print(f"   - ({source}) {pdf_url}: {reason}")
         
     except Exception as e:
         print(f" A general error occurred in run_retrieval: {e}")
-        
-    finally:
-        if db_conn and db_conn.is_connected():
-            db_conn.close()
-            print("\nDatabase connection closed by retrieval agent.")
 
 
 if __name__ == '__main__': 
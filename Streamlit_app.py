@@ -9,7 +9,7 @@ import traceback
 
 try:
     from Retrieval_agent import run_retrieval
-    from Preprocessing_agent import run_preprocessing
+    from Preprocessing_agent import run_preprocessing, run_preprocessing_alongside
     from Summarization_agent import run_summarization
     from Comparative_analysis import run_comparative_analysis
     from Gap_identification import run_gap_identification_agent
@@ -62,6 +62,9 @@ def clear_database(status_ui):
         cursor.execute("SET FOREIGN_KEY_CHECKS = 0;")
         cursor.execute("TRUNCATE TABLE analyses;")
         cursor.execute("TRUNCATE TABLE papers1;")
+        cursor.execute("TRUNCATE TABLE paper_texts;")
+        cursor.execute("TRUNCATE TABLE paper_pages;")
+        cursor.execute("TRUNCATE TABLE paper_sections;")
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1;")
         db_conn.commit()
         cursor.close()
@@ -87,14 +90,9 @@ def run_pipeline(search_topic, status_ui):
             return None, 0
 
         
-        status_ui.info(" [1/7] Running Retrieval Agent: Fetching and downloading papers...")
-        run_retrieval(search_topic)
-        status_ui.success(" [1/7] Retrieval Agent Finished.")
-
-        
-        status_ui.info(" [2/7] Running Preprocessing Agent: Extracting text from PDFs...")
-        run_preprocessing()
-        status_ui.success("[2/7] Preprocessing Agent Finished.")
+        status_ui.info(" [1-2/7] Running Retrieval and Preprocessing Agents: Downloading papers and extracting text as they arrive...")
+        run_preprocessing_alongside(lambda: run_retrieval(search_topic), name="retrieval")
+        status_ui.success(" [1-2/7] Retrieval and Preprocessing Agents Finished.")
 
        
         status_ui.info(" [3/7] Running Summarization Agent: Summarizing extracted text...")
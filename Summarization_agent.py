@@ -1,28 +1,89 @@
 import mysql.connector
 from mysql.connector import Error
-import vertexai
-from vertexai.generative_models import GenerativeModel, HarmCategory, HarmBlockThreshold
 import os
 import sys
 import re
 import time
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fulltext_store import load_pages
+from llm_cache import print_llm_cache_stats
+from llm_client import generate_text, estimate_tokens, get_llm_metrics, print_llm_metrics, CHARS_PER_TOKEN, DEFAULT_MODEL
 
-GCP_PROJECT_ID = "" 
-GCP_LOCATION = "us-central1" 
 DB_CONFIG = {
     'host': 'localhost',
     'user': 'root',
     'password': '', 
     'database': 'agentic_ai_db'
 }
+MAX_SOURCE_CHARS = 1000000
+# Sections the summary headings draw on; references, acknowledgements and appendices are left out
+SUMMARY_SECTIONS = ('abstract', 'introduction', 'methods', 'results', 'discussion', 'conclusion')
+MIN_SUMMARY_SECTIONS = 2
+PREAMBLE_CHARS = 3000
 
-try:
-    if GCP_PROJECT_ID:
-        vertexai.init(project=GCP_PROJECT_ID, location=GCP_LOCATION)
-    else:
-        print(" WARNING: GCP_PROJECT_ID is not set. API calls will fail.")
-except Exception as e:
-    print(f" Error initializing Vertex AI: {e}")
+# Concurrent summarization: at most SUMMARY_WORKERS model calls in flight
+# (map-reduce chunk calls included, see call_gemini_api), sharing one
+# per-minute request and token budget. Tokens are estimated locally
+# (llm_client.estimate_tokens).
+SUMMARY_WORKERS = 4
+SUMMARY_REQUESTS_PER_MINUTE = 60
+SUMMARY_TOKENS_PER_MINUTE = 1000000
+
+# Papers whose prompt source is estimated above MAP_REDUCE_THRESHOLD_TOKENS are
+# split into chunks of about MAP_REDUCE_CHUNK_TOKENS, summarized in parallel on
+# MAP_REDUCE_WORKERS threads and merged in one final call. Chunk calls still
+# count against the SUMMARY_WORKERS in-flight limit.
+# benchmark_summary_modes() compares this with single-shot mode.
+MAP_REDUCE_THRESHOLD_TOKENS = 60000
+MAP_REDUCE_CHUNK_TOKENS = 12000
+MAP_REDUCE_WORKERS = 4
+
+# Extraction quality gate. Texts failing any check are marked with a
+# quality_reason and never sent to the model.
+QUALITY_MIN_CHARS = 2000
+QUALITY_MIN_WORDS = 300
+QUALITY_MIN_PRINTABLE_RATIO = 0.90
+QUALITY_MIN_ASCII_RATIO = 0.60
+QUALITY_MIN_ALPHA_WORD_RATIO = 0.50
+QUALITY_WORD_LENGTH_RANGE = (2.5, 12.0)
+QUALITY_MAX_DUPLICATE_LINE_RATIO = 0.50
+WORD_PATTERN = re.compile(r'\S+')
+ALPHA_WORD_PATTERN = re.compile(r'[A-Za-z]{2,}')
+NON_PRINTABLE_PATTERN = re.compile(r'[^\S \t\n\r]|[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ufffd]')
+HTML_PATTERN = re.compile(r'<\s*(?:!doctype\s+html|html|head|body|script)\b', re.IGNORECASE)
+
+# Boilerplate stripping. A references heading only cuts the tail when it sits
+# past REFERENCES_MIN_POSITION of the text. A short line found on at least
+# REPEATED_LINE_MIN_PAGES pages and REPEATED_LINE_MIN_PAGE_SHARE of all pages
+# is treated as a running header or footer. Stamp and footer lines must match
+# BOILERPLATE_LINE as a whole and be at most BOILERPLATE_LINE_MAX_CHARS long.
+REFERENCES_MIN_POSITION = 0.5
+REPEATED_LINE_MIN_PAGES = 3
+REPEATED_LINE_MIN_PAGE_SHARE = 0.5
+REPEATED_LINE_MAX_CHARS = 120
+# Bare page-number lines are only removed among the first and last
+# PAGE_EDGE_LINES non-empty lines of a page, so numeric table cells survive.
+PAGE_EDGE_LINES = 3
+BOILERPLATE_LINE_MAX_CHARS = 120
+REFERENCES_HEADING = re.compile(
+    r'^[ \t]*(?:\d+\.?|[IVX]+\.)?[ \t]*(?:references|bibliography|works cited|literature cited)[ \t]*:?[ \t]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+PAGE_NUMBER_LINE = re.compile(r'(?:page\s+)?\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?|(?=[ivxlc])c{0,3}(?:x[cl]|l?x{0,3})(?:i[xv]|v?i{0,3})|-\s*\d{1,4}\s*-', re.IGNORECASE)
+BOILERPLATE_LINE = re.compile(
+    r'arxiv:\d{4}\.\d{4,5}(?:v\d+)?(?:\s*\[[\w.-]+\])?(?:\s+\d{1,2}\s+[a-z]{3}\s+\d{4})?'
+    r'|(?:copyright\s*)?(?:©|\(c\))\s*(?:\d{4}|the authors?).*|.*\ball rights reserved\.?'
+    r'|permission to make digital or hard copies .*|authorized licensed use limited to:? .*|restrictions apply\.?'
+    r'|(?:this|the) (?:work|article|paper) is licensed under (?:a |the )?creative commons.*'
+    r'|preprint\.?\s*under review\.?|(?:https?://)?(?:dx\.)?doi\.org/10\.\S+|doi:\s*10\.\S+',
+    re.IGNORECASE
+)
+
+_map_executor = None
+_map_executor_lock = threading.Lock()
+_in_flight_calls = threading.BoundedSemaphore(SUMMARY_WORKERS)
 
 def get_db_connection():
     try:
@@ -36,16 +97,155 @@ def get_db_connection():
 def get_papers_to_summarize(connection):
     cursor = connection.cursor(dictionary=True)
     query = """
-        SELECT id, title, full_text 
-        FROM papers1 
-        WHERE full_text IS NOT NULL 
-        AND (abstract IS NULL OR abstract NOT LIKE '%Introduction:%'); 
+        SELECT p.id, p.title 
+        FROM papers1 p 
+        JOIN paper_texts t ON t.paper_id = p.id 
+        WHERE (p.abstract IS NULL OR p.abstract NOT LIKE '%Introduction:%') 
+        AND p.quality_reason IS NULL; 
     """
     cursor.execute(query)
     results = cursor.fetchall()
     cursor.close()
     return results
 
+def get_paper_sections(connection, paper_ids):
+    """Returns {paper_id: [(section, start_offset, end_offset), ...]} from the extraction index."""
+    if not paper_ids:
+        return {}
+    cursor = connection.cursor()
+    placeholders = ", ".join(["%s"] * len(paper_ids))
+    query = f"""
+        SELECT paper_id, section, start_offset, end_offset FROM paper_sections
+        WHERE paper_id IN ({placeholders}) ORDER BY paper_id, start_offset
+    """
+    try:
+        cursor.execute(query, tuple(paper_ids))
+        sections = {}
+        for paper_id, section, start_offset, end_offset in cursor.fetchall():
+            sections.setdefault(paper_id, []).append((section, start_offset, end_offset))
+        return sections
+    except Error as e:
+        print(f" Could not read section index, using full text: {e}")
+        return {}
+    finally:
+        cursor.close()
+
+def build_source_text(full_text, sections):
+    """
+    Keeps the title/author preamble and the sections the summary needs.
+    Falls back to the full text when too few sections were detected.
+    """
+    wanted = [(start, end) for section, start, end in sections or [] if section in SUMMARY_SECTIONS]
+    if len({section for section, _, _ in sections or [] if section in SUMMARY_SECTIONS}) < MIN_SUMMARY_SECTIONS:
+        return full_text[:MAX_SOURCE_CHARS]
+    first_start = min(start for _, start, _ in sections)
+    parts = [full_text[:min(first_start, PREAMBLE_CHARS)]]
+    parts.extend(full_text[start:end] for start, end in wanted)
+    return "\n".join(parts)[:MAX_SOURCE_CHARS]
+
+def find_running_lines(pages):
+    """Returns the short lines repeated across enough pages to be running headers or footers."""
+    page_counts = Counter()
+    for page in pages:
+        page_counts.update({line.strip() for line in page.split('\n') if 0 < len(line.strip()) <= REPEATED_LINE_MAX_CHARS})
+    min_pages = max(REPEATED_LINE_MIN_PAGES, len(pages) * REPEATED_LINE_MIN_PAGE_SHARE)
+    return {line for line, count in page_counts.items() if count >= min_pages}
+
+def blank_page_numbers(pages):
+    """
+    Replaces page-number lines at the top and bottom of each page with spaces
+    of the same length, so offsets into the joined text stay valid.
+    Returns (pages, characters_blanked).
+    """
+    blanked_pages = []
+    blanked = 0
+    for page in pages:
+        lines = page.split('\n')
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        for i in filled[:PAGE_EDGE_LINES] + filled[-PAGE_EDGE_LINES:]:
+            if PAGE_NUMBER_LINE.fullmatch(lines[i].strip()):
+                blanked += len(lines[i])
+                lines[i] = ' ' * len(lines[i])
+        blanked_pages.append('\n'.join(lines))
+    return blanked_pages, blanked
+
+def strip_boilerplate(text, running_lines=()):
+    """
+    Removes the references tail, running headers and footers (running_lines,
+    from find_running_lines) and whole licence/copyright stamp lines. Page
+    numbers are removed per page beforehand (blank_page_numbers).
+    Returns (reduced_text, characters_removed).
+    """
+    if not text:
+        return "", 0
+    original_length = len(text)
+
+    references = None
+    for references in REFERENCES_HEADING.finditer(text):
+        pass
+    if references and references.start() >= original_length * REFERENCES_MIN_POSITION:
+        text = text[:references.start()]
+
+    lines = text.split('\n')
+    stripped = [line.strip() for line in lines]
+    kept = [
+        line for line, key in zip(lines, stripped)
+        if not key or not (
+            key in running_lines
+            or (len(key) <= BOILERPLATE_LINE_MAX_CHARS and BOILERPLATE_LINE.fullmatch(key))
+        )
+    ]
+    reduced = '\n'.join(kept)
+    return reduced, original_length - len(reduced)
+
+def assess_text_quality(text):
+    """
+    Scores an extracted text with cheap local checks. Returns (reason, metrics),
+    where reason is None when the text is good enough to summarize.
+    """
+    text = text or ""
+    length = len(text)
+    words = WORD_PATTERN.findall(text)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    metrics = {
+        'chars': length,
+        'words': len(words),
+        'printable_ratio': 1 - len(NON_PRINTABLE_PATTERN.findall(text)) / length if length else 0.0,
+        'ascii_ratio': len(text.encode('ascii', 'ignore')) / length if length else 0.0,
+        'alpha_word_ratio': sum(1 for word in words if ALPHA_WORD_PATTERN.search(word)) / len(words) if words else 0.0,
+        'mean_word_length': sum(len(word) for word in words) / len(words) if words else 0.0,
+        'duplicate_line_ratio': 1 - len(Counter(lines)) / len(lines) if lines else 0.0,
+    }
+
+    if length < QUALITY_MIN_CHARS:
+        return f"too short ({length} chars)", metrics
+    if HTML_PATTERN.search(text[:5000]):
+        return "looks like an HTML page", metrics
+    if len(words) < QUALITY_MIN_WORDS:
+        return f"too few words ({len(words)})", metrics
+    if metrics['printable_ratio'] < QUALITY_MIN_PRINTABLE_RATIO:
+        return f"mostly unprintable characters ({metrics['printable_ratio']:.0%} printable)", metrics
+    if metrics['ascii_ratio'] < QUALITY_MIN_ASCII_RATIO:
+        return f"mostly non-ASCII text ({metrics['ascii_ratio']:.0%} ASCII)", metrics
+    if metrics['alpha_word_ratio'] < QUALITY_MIN_ALPHA_WORD_RATIO:
+        return f"few real words ({metrics['alpha_word_ratio']:.0%} alphabetic)", metrics
+    low, high = QUALITY_WORD_LENGTH_RANGE
+    if not low <= metrics['mean_word_length'] <= high:
+        return f"unusual mean word length ({metrics['mean_word_length']:.1f})", metrics
+    if metrics['duplicate_line_ratio'] > QUALITY_MAX_DUPLICATE_LINE_RATIO:
+        return f"repetitive text ({metrics['duplicate_line_ratio']:.0%} duplicate lines)", metrics
+    return None, metrics
+
+def mark_quality_failure(connection, paper_id, reason):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("UPDATE papers1 SET quality_reason = %s WHERE id = %s", (reason[:255], paper_id))
+        connection.commit()
+    except Error as e:
+        print(f"Error saving quality result for paper ID {paper_id}: {e}")
+    finally:
+        cursor.close()
+
 def update_paper_with_summary(connection, paper_id, summary):
     cursor = connection.cursor()
     
@@ -67,39 +267,219 @@ def clean_text(raw_text):
     text = re.sub(r'\s+', ' ', text) 
     return text.strip()
 
-def call_gemini_api(prompt, model_name="gemini-2.0-flash-lite-001"): 
-    if not GCP_PROJECT_ID:
-        print("ERROR: GCP_PROJECT_ID is not set. Cannot call API.")
-        return False, "GCP Project ID not configured."
-        
-    model = GenerativeModel(model_name)
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    }
+def call_gemini_api(prompt, model_name=DEFAULT_MODEL, budget=None, use_cache=True): 
+    with _in_flight_calls:
+        return generate_text(prompt, model_name, budget=budget, use_cache=use_cache)
+
+class QuotaBudget:
+    """
+    Shared requests-per-minute and tokens-per-minute budget over a sliding
+    60 second window. acquire() blocks until a request of the given size
+    fits. Back-off after a 429 is handled by the shared limiter in
+    llm_client.
+    """
+
+    def __init__(self, requests_per_minute=SUMMARY_REQUESTS_PER_MINUTE, tokens_per_minute=SUMMARY_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = deque()
+        self.window_tokens = 0
+        self.lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.tokens_per_minute)
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.window and now - self.window[0][0] >= 60:
+                    self.window_tokens -= self.window.popleft()[1]
+                if len(self.window) < self.requests_per_minute and self.window_tokens + tokens <= self.tokens_per_minute:
+                    self.window.append((now, tokens))
+                    self.window_tokens += tokens
+                    self.waited_seconds += now - start
+                    return
+                wait_seconds = 60 - (now - self.window[0][0]) if self.window else 0.1
+            time.sleep(min(max(wait_seconds, 0.05), 5))
+
+SUMMARY_HEADINGS = """Introduction: (Briefly state the problem, context, and paper's main goal)
+            Methodology: (Describe the key methods, techniques, algorithms, and experimental setup)
+            Datasets: (Identify the specific datasets used, including size or source if mentioned)
+            Results: (Summarize the main quantitative or qualitative findings reported)
+            Discussion/Limitations: (Briefly mention any discussion points or limitations acknowledged by the authors)
+            Conclusion: (State the main conclusion and key takeaway of the paper)"""
+
+def build_summary_prompt(source_text):
+    return f"""
+            As an expert research analyst, your task is to create a comprehensive, structured summary of the following research paper text. 
+            Read the text carefully from beginning to end and extract the most important information for each section defined below.
+            Be concise yet thorough. Use full sentences and academic language.
+
+            Here is the text:
+            ---
+            {source_text}
+            ---
+
+            Generate a summary with the following exact headings in Markdown bold format:
+            {SUMMARY_HEADINGS}
+            """
+
+def build_chunk_prompt(chunk, index, total):
+    return f"""
+            As an expert research analyst, you are reading part {index} of {total} of a research paper.
+            Extract concise notes from this part only, grouped under the headings below. Keep concrete
+            details such as method names, dataset names and sizes, and reported numbers. Write "None" under
+            a heading if this part says nothing relevant to it.
+
+            Here is the text:
+            ---
+            {chunk}
+            ---
+
+            Headings:
+            {SUMMARY_HEADINGS}
+            """
+
+def build_reduce_prompt(notes):
+    joined = "\n\n".join(f"Notes from part {i}:\n{note}" for i, note in enumerate(notes, start=1))
+    return f"""
+            As an expert research analyst, you are given notes taken from consecutive parts of one research paper.
+            Merge them into a single comprehensive, structured summary of the paper, removing repetition.
+            Be concise yet thorough. Use full sentences and academic language.
+
+            Here are the notes:
+            ---
+            {joined}
+            ---
+
+            Generate a summary with the following exact headings in Markdown bold format:
+            {SUMMARY_HEADINGS}
+            """
+
+def split_into_chunks(text, chunk_tokens=MAP_REDUCE_CHUNK_TOKENS):
+    """Splits text into chunks of about chunk_tokens estimated tokens, ending at sentence boundaries where possible."""
+    chunk_chars = max(1, chunk_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            boundary = text.rfind('. ', start + int(chunk_chars * 0.8), end)
+            if boundary == -1:
+                boundary = text.rfind(' ', start + int(chunk_chars * 0.8), end)
+            if boundary != -1:
+                end = boundary + 1
+        chunks.append(text[start:end].strip())
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+def get_map_executor():
+    global _map_executor
+    with _map_executor_lock:
+        if _map_executor is None:
+            _map_executor = ThreadPoolExecutor(max_workers=MAP_REDUCE_WORKERS, thread_name_prefix='summarize-chunk')
+        return _map_executor
+
+def summarize_map_reduce(source_text, budget, chunk_tokens=MAP_REDUCE_CHUNK_TOKENS, use_cache=True):
+    """Summarizes each chunk in parallel, then merges the chunk notes into the six headings. Returns (success, summary, prompts)."""
+    chunks = split_into_chunks(source_text, chunk_tokens)
+    futures = [
+        get_map_executor().submit(call_gemini_api, build_chunk_prompt(chunk, i, len(chunks)), budget=budget, use_cache=use_cache)
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+    notes = []
+    for i, future in enumerate(futures, start=1):
+        success, note = future.result()
+        if not success:
+            return False, f"Part {i} of {len(chunks)} failed: {note}", len(chunks)
+        notes.append(note)
+    success, summary = call_gemini_api(build_reduce_prompt(notes), budget=budget, use_cache=use_cache)
+    return success, summary, len(chunks) + 1
+
+def prepare_source(db_conn, paper, sections, stats, persist=True):
+    """
+    Loads, gates and reduces a paper's text. Returns the prompt source, or None
+    if it failed the quality gate. Gate failures are written to papers1 only
+    when persist is true.
+    """
+    pages = load_pages(db_conn, paper['id'])
+    full_text = "".join(pages)
+    reason, _ = assess_text_quality(full_text)
+    if reason:
+        print(f"Skipping paper ID {paper['id']}: extracted text failed the quality gate ({reason}).")
+        if persist:
+            mark_quality_failure(db_conn, paper['id'], reason)
+        stats['rejected'].append((paper['id'], reason))
+        return None
+    pages, removed = blank_page_numbers(pages)
+    selected = build_source_text("".join(pages), sections)
+    if len(selected) >= MAX_SOURCE_CHARS:
+        print(f"WARNING: paper ID {paper['id']} was cut to the first {MAX_SOURCE_CHARS} characters.")
+    source_text, stripped = strip_boilerplate(selected, find_running_lines(pages))
+    removed += stripped
+    source_text = clean_text(source_text)
+    stats['full_chars'] += len(full_text)
+    stats['sent_chars'] += len(source_text)
+    stats['stripped_chars'] += removed
+    mode = "map-reduce" if estimate_tokens(source_text) > MAP_REDUCE_THRESHOLD_TOKENS else "single-shot"
+    print(f"Prepared paper ID {paper['id']} ('{paper['title'][:50]}...'): {len(source_text)} of {len(full_text)} characters "
+          f"({removed} removed as references/boilerplate), {mode}.")
+    return source_text
+
+def summarize_paper(source_text, budget, threshold_tokens=MAP_REDUCE_THRESHOLD_TOKENS, chunk_tokens=MAP_REDUCE_CHUNK_TOKENS, use_cache=True):
+    """
+    Returns (success, summary, elapsed_seconds, prompts), switching to map-reduce
+    above threshold_tokens. prompts counts cache hits too; see get_llm_metrics()
+    for the calls that reached the model.
+    """
+    start_time = time.perf_counter()
+    if estimate_tokens(source_text) > threshold_tokens:
+        success, summary, prompts = summarize_map_reduce(source_text, budget, chunk_tokens, use_cache)
+    else:
+        success, summary = call_gemini_api(build_summary_prompt(source_text), budget=budget, use_cache=use_cache)
+        prompts = 1
+    return success, summary, time.perf_counter() - start_time, prompts
+
+def benchmark_summary_modes(paper_ids=None, chunk_token_sizes=(4000, 8000, 16000)):
+    """
+    Summarizes the same papers single-shot and in map-reduce mode at each chunk
+    size, printing wall time, API calls and estimated input tokens per mode.
+    The LLM response cache is bypassed so every mode really calls the model.
+    Summaries are not saved.
+    """
+    db_conn = get_db_connection()
+    if not db_conn:
+        return
+    try:
+        papers = get_papers_to_summarize(db_conn)
+        if paper_ids:
+            papers = [paper for paper in papers if paper['id'] in paper_ids]
+        sections = get_paper_sections(db_conn, [paper['id'] for paper in papers])
+        stats = {'full_chars': 0, 'sent_chars': 0, 'stripped_chars': 0, 'rejected': []}
+        sources = [source for source in (prepare_source(db_conn, paper, sections.get(paper['id']), stats, persist=False) for paper in papers) if source]
+    finally:
+        db_conn.close()
+    if not sources:
+        print("No papers to benchmark.")
+        return
 
-    max_retries = 5
-    delay = 15
-    for attempt in range(max_retries):
-        try:
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-            if response.candidates and response.candidates[0].content.parts:
-                return True, response.text.strip()
-            else:
-                reason = response.candidates[0].finish_reason.name if response.candidates else "UNKNOWN"
-                return False, f"Response was blocked or empty. Reason: {reason}"
-        except Exception as e:
-            if "429" in str(e): 
-                print(f"Rate limit hit. Waiting for {delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                time.sleep(delay)
-                delay *= 2
-            else: 
-                print(f"An unexpected error occurred with the Vertex AI API: {e}")
-                return False, f"An unexpected error occurred: {e}"
-                
-    return False, "Failed to get response after multiple retries due to rate limiting."
+    modes = [("single-shot", float('inf'), MAP_REDUCE_CHUNK_TOKENS)]
+    modes += [(f"map-reduce {size} tok", 0, size) for size in chunk_token_sizes]
+    print(f"\n Benchmarking {len(sources)} papers ({sum(estimate_tokens(s) for s in sources)} estimated input tokens):")
+    for name, threshold, chunk_tokens in modes:
+        budget = QuotaBudget()
+        start_time = time.perf_counter()
+        latencies, failures = [], 0
+        calls_before = get_llm_metrics()['calls']
+        for source_text in sources:
+            success, _, elapsed, _ = summarize_paper(source_text, budget, threshold, chunk_tokens, use_cache=False)
+            latencies.append(elapsed)
+            failures += not success
+        calls = get_llm_metrics()['calls'] - calls_before
+        latencies.sort()
+        print(f"   - {name}: {time.perf_counter() - start_time:.1f}s total, {calls} calls, {failures} failed, "
+              f"median {latencies[len(latencies) // 2]:.1f}s, max {latencies[-1]:.1f}s per paper")
 
 def run_summarization():
     print(f"\n{'='*25} EXECUTING AGENT: Summarization_agent.py {'='*25}")
@@ -115,39 +495,69 @@ def run_summarization():
             print("No new papers to summarize.")
             return
 
-        print(f"  Found {len(papers_to_summarize)} papers to summarize.")
-        for paper in papers_to_summarize:
-            print(f"\n Summarizing paper ID: {paper['id']} ('{paper['title'][:50]}...')")
-            
-            source_text = clean_text(paper['full_text'][:1000000]) 
+        print(f"  Found {len(papers_to_summarize)} papers to summarize "
+              f"({SUMMARY_WORKERS} in flight, {SUMMARY_REQUESTS_PER_MINUTE} requests/min, {SUMMARY_TOKENS_PER_MINUTE} tokens/min).")
+        paper_sections = get_paper_sections(db_conn, [paper['id'] for paper in papers_to_summarize])
+        stats = {'full_chars': 0, 'sent_chars': 0, 'stripped_chars': 0, 'rejected': []}
+        budget = QuotaBudget()
+        queue = iter(papers_to_summarize)
+        pending = {}
+        summarized = 0
+        prompts_sent = 0
+        calls_before = get_llm_metrics()['calls']
+        call_seconds = 0.0
+        stage_start = time.perf_counter()
 
-            prompt = f"""
-            As an expert research analyst, your task is to create a comprehensive, structured summary of the following research paper text. 
-            Read the text carefully from beginning to end and extract the most important information for each section defined below.
-            Be concise yet thorough. Use full sentences and academic language.
+        # Prompts are prepared and results written on this thread, which owns
+        # the database connection; only the API calls run on the pool.
+        with ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix='summarize') as executor:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < SUMMARY_WORKERS:
+                    paper = next(queue, None)
+                    if paper is None:
+                        exhausted = True
+                        break
+                    source_text = prepare_source(db_conn, paper, paper_sections.get(paper['id']), stats)
+                    if source_text is not None:
+                        pending[executor.submit(summarize_paper, source_text, budget)] = paper
 
-            Here is the text:
-            ---
-            {source_text}
-            ---
+                if not pending:
+                    break
 
-            Generate a summary with the following exact headings in Markdown bold format:
-            Introduction: (Briefly state the problem, context, and paper's main goal)
-            Methodology: (Describe the key methods, techniques, algorithms, and experimental setup)
-            Datasets: (Identify the specific datasets used, including size or source if mentioned)
-            Results: (Summarize the main quantitative or qualitative findings reported)
-            Discussion/Limitations: (Briefly mention any discussion points or limitations acknowledged by the authors)
-            Conclusion: (State the main conclusion and key takeaway of the paper)
-            """
-            
-            success, summary = call_gemini_api(prompt)
-
-            if success:
-                preview_summary = summary.replace('\n', ' ') 
-                print(f"Generated Summary Preview: {preview_summary[:150]}...")
-                update_paper_with_summary(db_conn, paper['id'], summary) 
-            else:
-                print(f"Skipping database update for paper ID {paper['id']}. Reason: {summary}") 
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    paper = pending.pop(future)
+                    try:
+                        success, summary, elapsed, prompts = future.result()
+                    except Exception as e:
+                        success, summary, elapsed, prompts = False, f"An unexpected error occurred: {e}", 0.0, 0
+                    call_seconds += elapsed
+                    prompts_sent += prompts
+
+                    if success:
+                        preview_summary = summary.replace('\n', ' ') 
+                        print(f"\n Paper ID {paper['id']} summarized in {elapsed:.1f}s. Preview: {preview_summary[:150]}...")
+                        update_paper_with_summary(db_conn, paper['id'], summary) 
+                        summarized += 1
+                    else:
+                        print(f"Skipping database update for paper ID {paper['id']}. Reason: {summary}") 
+
+        stage_seconds = time.perf_counter() - stage_start
+        api_calls = get_llm_metrics()['calls'] - calls_before
+        print(f"\n  Summarized {summarized} papers in {stage_seconds:.1f}s with {prompts_sent} prompts "
+              f"({api_calls} API calls including retries, cache hits excluded; {call_seconds:.1f}s of paper time, {budget.waited_seconds:.1f}s waiting for quota).")
+        rejected = stats['rejected']
+        if rejected:
+            print(f"\n  Quality gate kept {len(rejected)} of {len(papers_to_summarize)} papers out of the LLM queue:")
+            for paper_id, reason in rejected:
+                print(f"   - Paper ID {paper_id}: {reason}")
+        if stats['full_chars']:
+            print(f"\n  Sent {stats['sent_chars']} of {stats['full_chars']} full-text characters "
+                  f"({100 * (1 - stats['sent_chars'] / stats['full_chars']):.1f}% fewer input characters, "
+                  f"{stats['stripped_chars']} removed as references/boilerplate).")
+        print_llm_cache_stats()
+        print_llm_metrics()
 
     finally:
         if db_conn and db_conn.is_connected():
@@ -0,0 +1,173 @@
+"""
+Out-of-row storage for extracted paper text.
+
+Text is stored once, page by page, in paper_pages, compressed with zstd when
+the `zstandard` package is installed and with zlib otherwise, so that papers1
+stays small for metadata and summary queries and later stages can read only
+the pages they need. paper_texts holds one small index row per paper (page
+count and sizes); the full text is the concatenation of its pages. Every
+agent reads and writes full text through these helpers.
+"""
+import zlib
+from mysql.connector import Error
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+# Texts shorter than this are stored uncompressed
+MIN_COMPRESS_BYTES = 256
+LOAD_CHUNK_SIZE = 100
+
+DEFAULT_CODEC = 'zstd' if zstandard else 'zlib'
+
+SAVE_TEXT_INDEX_QUERY = """
+    INSERT INTO paper_texts (paper_id, page_count, raw_bytes, compressed_bytes)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE page_count = VALUES(page_count), raw_bytes = VALUES(raw_bytes),
+        compressed_bytes = VALUES(compressed_bytes)
+"""
+
+SAVE_PAGE_QUERY = """
+    INSERT INTO paper_pages (paper_id, page_number, codec, raw_bytes, content)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def compress_text(text, codec=DEFAULT_CODEC):
+    """Returns (codec, raw_bytes, blob) for a text."""
+    raw = text.encode('utf-8')
+    if len(raw) < MIN_COMPRESS_BYTES:
+        return 'none', len(raw), raw
+    if codec == 'zstd' and zstandard:
+        return 'zstd', len(raw), zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return 'zlib', len(raw), zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress_text(codec, blob):
+    """Inverse of compress_text."""
+    blob = bytes(blob)
+    if codec == 'zstd':
+        if not zstandard:
+            raise RuntimeError("This full text is zstd-compressed but the 'zstandard' package is not installed.")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    elif codec == 'zlib':
+        raw = zlib.decompress(blob)
+    else:
+        raw = blob
+    return raw.decode('utf-8')
+
+
+def save_full_texts(cursor, rows):
+    """
+    Replaces the stored pages of (paper_id, pages) rows, compressing each page,
+    and upserts each paper's index row. Returns (raw_bytes, compressed_bytes).
+    """
+    page_params = []
+    index_params = []
+    raw_total = compressed_total = 0
+    for paper_id, pages in rows:
+        paper_raw = paper_compressed = 0
+        for page_number, page in enumerate(pages, start=1):
+            codec, raw_bytes, blob = compress_text(page)
+            page_params.append((paper_id, page_number, codec, raw_bytes, blob))
+            paper_raw += raw_bytes
+            paper_compressed += len(blob)
+        index_params.append((paper_id, len(pages), paper_raw, paper_compressed))
+        raw_total += paper_raw
+        compressed_total += paper_compressed
+    if index_params:
+        cursor.executemany("DELETE FROM paper_pages WHERE paper_id = %s", [(paper_id,) for paper_id, *_ in index_params])
+        cursor.executemany(SAVE_TEXT_INDEX_QUERY, index_params)
+    if page_params:
+        cursor.executemany(SAVE_PAGE_QUERY, page_params)
+    return raw_total, compressed_total
+
+
+def load_pages(connection, paper_id, first_page=1, last_page=None):
+    """Returns the texts of a page range (1-based, inclusive) of one paper."""
+    cursor = connection.cursor()
+    try:
+        if last_page is None:
+            cursor.execute(
+                "SELECT codec, content FROM paper_pages WHERE paper_id = %s AND page_number >= %s ORDER BY page_number",
+                (paper_id, first_page)
+            )
+        else:
+            cursor.execute(
+                "SELECT codec, content FROM paper_pages WHERE paper_id = %s AND page_number BETWEEN %s AND %s ORDER BY page_number",
+                (paper_id, first_page, last_page)
+            )
+        return [decompress_text(codec, blob) for codec, blob in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def load_full_texts(connection, paper_ids):
+    """Returns {paper_id: text} for the given papers that have stored text."""
+    paper_ids = list(paper_ids)
+    texts = {}
+    cursor = connection.cursor()
+    try:
+        for i in range(0, len(paper_ids), LOAD_CHUNK_SIZE):
+            chunk = paper_ids[i:i + LOAD_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"SELECT paper_id, codec, content FROM paper_pages WHERE paper_id IN ({placeholders}) "
+                f"ORDER BY paper_id, page_number",
+                tuple(chunk)
+            )
+            pages = {}
+            for paper_id, codec, blob in cursor.fetchall():
+                pages.setdefault(paper_id, []).append(decompress_text(codec, blob))
+            texts.update((paper_id, "".join(paper_pages)) for paper_id, paper_pages in pages.items())
+    finally:
+        cursor.close()
+    return texts
+
+
+def load_full_text(connection, paper_id):
+    """Returns the stored text of one paper, or None."""
+    return load_full_texts(connection, [paper_id]).get(paper_id)
+
+
+STORAGE_STATS_QUERIES = {
+    'paper_pages': "SELECT COUNT(DISTINCT paper_id), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(LENGTH(content)), 0) FROM paper_pages",
+    'extraction_cache': "SELECT COUNT(*), 0, COALESCE(SUM(LENGTH(content)), 0) FROM extraction_cache",
+}
+
+
+def get_storage_stats(connection):
+    """
+    Returns {table: (papers, raw_bytes, stored_bytes)} for every table that
+    holds a copy of the extracted text: paper_pages, and extraction_cache,
+    which keeps compressed JSON across runs (its raw_bytes is 0).
+    """
+    stats = {}
+    cursor = connection.cursor()
+    try:
+        for table, query in STORAGE_STATS_QUERIES.items():
+            cursor.execute(query)
+            papers, raw_bytes, stored_bytes = cursor.fetchone()
+            stats[table] = (int(papers), int(raw_bytes), int(stored_bytes))
+    except Error as e:
+        print(f" Could not read full-text storage stats: {e}")
+    finally:
+        cursor.close()
+    return stats
+
+
+def print_storage_stats(connection):
+    """Prints the stored size of all copies of the extracted text against the raw text size."""
+    stats = get_storage_stats(connection)
+    papers, raw_bytes, _ = stats.get('paper_pages', (0, 0, 0))
+    if not papers or not raw_bytes:
+        return
+    stored_bytes = sum(stored for _, _, stored in stats.values())
+    print(f"   - Full-text storage: {papers} papers, {raw_bytes / (1024 * 1024):.1f} MB of text stored as "
+          f"{stored_bytes / (1024 * 1024):.1f} MB in total ({100 * stored_bytes / raw_bytes:.0f}% of raw, codec {DEFAULT_CODEC})")
+    for table, (_, _, table_bytes) in stats.items():
+        print(f"       {table}: {table_bytes / (1024 * 1024):.1f} MB")
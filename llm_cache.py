@@ -0,0 +1,162 @@
+"""
+Persistent, content-addressed cache for Gemini responses.
+
+Responses are stored in a local SQLite file keyed by a SHA-256 of the model
+name, safety settings and prompt, so re-running the pipeline on unchanged
+inputs makes no Vertex AI calls. The file is kept under LLM_CACHE_MAX_BYTES
+by evicting the least recently used entries. Identical prompts issued
+concurrently share one in-flight call.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import closing
+
+LLM_CACHE_PATH = os.path.join('cache', 'llm_cache.sqlite3')
+LLM_CACHE_MAX_BYTES = 100 * 1024 * 1024
+# Set LLM_CACHE=0 in the environment to always call the model.
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE', '1') != '0'
+
+_cache_lock = threading.Lock()
+_inflight = {}
+_inflight_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evicted': 0}
+_stats_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def _open_llm_cache():
+    os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            cache_key TEXT PRIMARY KEY,
+            model_name TEXT,
+            response TEXT,
+            stored_at REAL,
+            accessed_at REAL,
+            size INTEGER
+        )
+    """)
+    return conn
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def llm_cache_key(model_name, safety_settings, prompt):
+    """Hashes everything that determines a response."""
+    settings = sorted(
+        (getattr(category, 'name', str(category)), getattr(threshold, 'name', str(threshold)))
+        for category, threshold in (safety_settings or {}).items()
+    )
+    payload = json.dumps({'model': model_name, 'safety': settings, 'prompt': prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_response(cache_key):
+    """Returns the cached response text, or None."""
+    try:
+        with _cache_lock, closing(_open_llm_cache()) as conn:
+            row = conn.execute("SELECT response FROM responses WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE cache_key = ?", (time.time(), cache_key))
+                conn.commit()
+                return row[0]
+    except sqlite3.Error as e:
+        print(f" WARNING: LLM cache read failed: {e}")
+    return None
+
+
+def put_cached_response(cache_key, model_name, response):
+    """Stores a response and evicts least recently used entries above the size limit."""
+    now = time.time()
+    size = len(response.encode('utf-8'))
+    try:
+        with _cache_lock, closing(_open_llm_cache()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, model_name, response, now, now, size)
+            )
+            total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > LLM_CACHE_MAX_BYTES:
+                evict_keys = []
+                for key, entry_size in conn.execute("SELECT cache_key, size FROM responses ORDER BY accessed_at ASC"):
+                    if total_size <= LLM_CACHE_MAX_BYTES:
+                        break
+                    evict_keys.append((key,))
+                    total_size -= entry_size
+                conn.executemany("DELETE FROM responses WHERE cache_key = ?", evict_keys)
+                with _stats_lock:
+                    _stats['evicted'] += len(evict_keys)
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f" WARNING: LLM cache write failed: {e}")
+
+
+def cached_completion(model_name, safety_settings, prompt, call):
+    """
+    Returns (success, text) for a prompt. call() performs the real request
+    and must return (success, text); only successful responses are cached.
+    Concurrent callers with the same key wait for a single call.
+    """
+    if not LLM_CACHE_ENABLED:
+        return call()
+
+    cache_key = llm_cache_key(model_name, safety_settings, prompt)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        _count('hits')
+        return True, cached
+
+    with _inflight_lock:
+        flight = _inflight.get(cache_key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[cache_key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        _count('coalesced')
+        return flight.result
+
+    try:
+        # Another caller may have finished the same prompt since the first lookup.
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            _count('hits')
+            flight.result = (True, cached)
+            return flight.result
+        _count('misses')
+        flight.result = (False, "The model call did not complete.")
+        flight.result = call()
+        success, text = flight.result
+        if success and text is not None:
+            put_cached_response(cache_key, model_name, text)
+        return flight.result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
+        flight.done.set()
+
+
+def get_llm_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def print_llm_cache_stats():
+    stats = get_llm_cache_stats()
+    lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+    if lookups:
+        print(f"   LLM response cache: {stats['hits']} hits, {stats['misses']} model calls, "
+              f"{stats['coalesced']} shared in-flight, {stats['evicted']} evicted")
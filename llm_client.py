@@ -0,0 +1,406 @@
+"""
+Shared Gemini client used by every agent that calls an LLM.
+
+All calls go through generate_text(), which applies the response cache
+(llm_cache.py), the process-wide adaptive rate limiter, one retry policy
+for rate limits, and per-call latency and token metrics. The backend is chosen with the LLM_BACKEND
+environment variable:
+
+    vertex  Vertex AI Gemini (default). vertexai.init runs on the first call.
+    fake    Deterministic local responses shaped like the requested output,
+            for offline runs, load tests and benchmarks.
+"""
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+from llm_cache import cached_completion
+
+GCP_PROJECT_ID = os.environ.get('GCP_PROJECT_ID', "")
+GCP_LOCATION = os.environ.get('GCP_LOCATION', "us-central1")
+DEFAULT_MODEL = "gemini-2.0-flash-lite-001"
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'vertex')
+
+# Retry policy for rate-limited calls: the limiter holds every caller back for
+# RETRY_BASE_DELAY seconds, doubling per consecutive 429 up to RETRY_MAX_DELAY,
+# with +/-20% jitter. Retries then re-enter the limiter queue.
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 15
+RETRY_MAX_DELAY = 240
+
+# Adaptive (AIMD) limit on request starts per minute shared by every LLM call
+# in the process: +LIMITER_INCREASE_RPM after each fast success, times
+# LIMITER_DECREASE_FACTOR on a 429 (at most once per LIMITER_DECREASE_COOLDOWN
+# seconds, since in-flight calls tend to fail together). Successes slower than
+# LIMITER_SLOW_LATENCY_SECONDS hold the rate instead of raising it.
+LIMITER_INITIAL_RPM = float(os.environ.get('LLM_REQUESTS_PER_MINUTE', '60'))
+LIMITER_MIN_RPM = 2
+LIMITER_MAX_RPM = 600
+LIMITER_INCREASE_RPM = 2
+LIMITER_DECREASE_FACTOR = 0.5
+LIMITER_DECREASE_COOLDOWN = 5
+LIMITER_SLOW_LATENCY_SECONDS = 30
+
+CHARS_PER_TOKEN = 4
+EXPECTED_OUTPUT_TOKENS = 1024
+
+# Artificial per-call latency (seconds) for the fake backend.
+FAKE_LATENCY_SECONDS = float(os.environ.get('LLM_FAKE_LATENCY', '0'))
+
+# Block threshold per harm category, by name, so the settings can be part of
+# the cache key without importing the Vertex SDK.
+SAFETY_SETTINGS = {
+    'HARM_CATEGORY_HARASSMENT': 'BLOCK_ONLY_HIGH',
+    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_ONLY_HIGH',
+    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_ONLY_HIGH',
+    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_ONLY_HIGH',
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+_metrics = {'calls': 0, 'failures': 0, 'rate_limited': 0, 'latency_seconds': 0.0,
+            'max_latency_seconds': 0.0, 'prompt_tokens': 0, 'output_tokens': 0}
+_metrics_lock = threading.Lock()
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class BlockedResponseError(Exception):
+    pass
+
+
+class BackendConfigError(Exception):
+    pass
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class AdaptiveRateLimiter:
+    """
+    Paces request starts at an allowed rate that is adjusted AIMD-style from
+    observed 429s and latency. acquire() reserves the next start slot and
+    sleeps until it, so waiting callers leave one at a time instead of
+    retrying in lockstep. A 429 holds every caller back until held_until.
+    """
+
+    def __init__(self, requests_per_minute=LIMITER_INITIAL_RPM):
+        self.requests_per_minute = min(max(requests_per_minute, LIMITER_MIN_RPM), LIMITER_MAX_RPM)
+        self.next_slot = 0.0
+        self.held_until = 0.0
+        self.last_decrease = float('-inf')
+        self.consecutive_rate_limits = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self.waited_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        start = time.monotonic()
+        with self.lock:
+            self.waiting += 1
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                slot = max(now, self.next_slot, self.held_until)
+                self.next_slot = slot + 60 / self.requests_per_minute
+            time.sleep(slot - now)
+            with self.lock:
+                # A 429 seen while sleeping moves held_until past this slot; queue again.
+                if time.monotonic() >= self.held_until:
+                    self.waiting -= 1
+                    self.in_flight += 1
+                    self.waited_seconds += time.monotonic() - start
+                    return
+
+    def on_success(self, latency):
+        with self.lock:
+            self.in_flight -= 1
+            self.consecutive_rate_limits = 0
+            if latency < LIMITER_SLOW_LATENCY_SECONDS:
+                self.requests_per_minute = min(self.requests_per_minute + LIMITER_INCREASE_RPM, LIMITER_MAX_RPM)
+
+    def on_failure(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def on_throttle(self):
+        """Lowers the rate and holds back every caller; returns the hold-off in seconds."""
+        with self.lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            # Calls that were in flight together usually fail together; count them as one.
+            if now - self.last_decrease >= LIMITER_DECREASE_COOLDOWN:
+                self.requests_per_minute = max(self.requests_per_minute * LIMITER_DECREASE_FACTOR, LIMITER_MIN_RPM)
+                self.last_decrease = now
+                self.consecutive_rate_limits += 1
+                delay = RETRY_BASE_DELAY * 2 ** (self.consecutive_rate_limits - 1)
+                self.held_until = max(self.held_until, now + min(delay, RETRY_MAX_DELAY) * random.uniform(0.8, 1.2))
+                # Restart pacing after the hold-off at the lowered rate.
+                self.next_slot = self.held_until
+            return max(self.held_until - now, 0)
+
+    def state(self):
+        with self.lock:
+            return {'requests_per_minute': self.requests_per_minute, 'queue_depth': self.waiting,
+                    'in_flight': self.in_flight, 'waited_seconds': self.waited_seconds}
+
+
+class VertexBackend:
+    """Gemini on Vertex AI. Initialises the SDK lazily and reuses one model object per model name."""
+
+    name = 'vertex'
+    cache_namespace = ''
+    rate_limited = True
+
+    def __init__(self, project_id=GCP_PROJECT_ID, location=GCP_LOCATION):
+        self.project_id = project_id
+        self.location = location
+        self.models = {}
+        self.safety_settings = None
+        self.lock = threading.Lock()
+
+    def _get_model(self, model_name):
+        with self.lock:
+            if self.safety_settings is None:
+                if not self.project_id:
+                    raise BackendConfigError("GCP project ID not configured. Set GCP_PROJECT_ID or use LLM_BACKEND=fake.")
+                import vertexai
+                from vertexai.generative_models import HarmCategory, HarmBlockThreshold
+                vertexai.init(project=self.project_id, location=self.location)
+                self.safety_settings = {
+                    getattr(HarmCategory, category): getattr(HarmBlockThreshold, threshold)
+                    for category, threshold in SAFETY_SETTINGS.items()
+                }
+            if model_name not in self.models:
+                from vertexai.generative_models import GenerativeModel
+                self.models[model_name] = GenerativeModel(model_name)
+            return self.models[model_name]
+
+    def generate(self, prompt, model_name):
+        """Returns (text, prompt_tokens, output_tokens)."""
+        model = self._get_model(model_name)
+        try:
+            response = model.generate_content(prompt, safety_settings=self.safety_settings)
+        except Exception as e:
+            if "429" in str(e) or "resource exhausted" in str(e).lower():
+                raise RateLimitError(str(e))
+            raise
+        if not (response.candidates and response.candidates[0].content.parts):
+            reason = response.candidates[0].finish_reason.name if response.candidates else "UNKNOWN"
+            raise BlockedResponseError(reason)
+        text = response.text.strip()
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or estimate_tokens(prompt)
+        output_tokens = getattr(usage, 'candidates_token_count', 0) or estimate_tokens(text)
+        return text, prompt_tokens, output_tokens
+
+
+class FakeBackend:
+    """
+    Deterministic offline backend. Responses depend only on the prompt and
+    follow the output format the prompt asks for: a Markdown table when one
+    is requested, otherwise one line per "Heading:" in the prompt's format
+    section, with scores filled in as percentages.
+    """
+
+    name = 'fake'
+    cache_namespace = 'fake/'
+    # Runs at full speed for load tests and benchmarks; not paced by the limiter.
+    rate_limited = False
+    HEADING = re.compile(r'^\s*([A-Z][A-Za-z/&\' -]{1,60}):\s*(\(.*\)|\[.*\])?\s*$')
+    COLUMNS = re.compile(r'"([^"]+)"')
+    TITLE = re.compile(r'^TITLE:\s*(.+)$', re.MULTILINE)
+    YEAR = re.compile(r'^YEAR:\s*(.+)$', re.MULTILINE)
+
+    def __init__(self, latency=FAKE_LATENCY_SECONDS):
+        self.latency = latency
+
+    def generate(self, prompt, model_name):
+        if self.latency:
+            time.sleep(self.latency)
+        seed = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        if 'Markdown table' in prompt and 'columns are' in prompt:
+            text = self._table(prompt, seed)
+        else:
+            text = self._headings(prompt, seed)
+        return text, estimate_tokens(prompt), estimate_tokens(text)
+
+    def _table(self, prompt, seed):
+        column_line = next(line for line in prompt.splitlines() if 'columns are' in line)
+        columns = self.COLUMNS.findall(column_line) or ["Title & Year", "Key Finding"]
+        titles = self.TITLE.findall(prompt)
+        years = self.YEAR.findall(prompt)
+        rows = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+        for i, title in enumerate(titles):
+            year = years[i] if i < len(years) else "n/a"
+            cells = [f"{title.strip()} ({year.strip()})"]
+            cells += [f"Offline {column.lower()} for paper {i + 1} ({seed[i % 56:i % 56 + 8]})." for column in columns[1:]]
+            rows.append("| " + " | ".join(cells) + " |")
+        return "\n".join(rows)
+
+    def _headings(self, prompt, seed):
+        # Only the format section after the last '---' delimiter is read, so
+        # colons inside the quoted paper text are ignored.
+        lines = prompt.splitlines()
+        last_delimiter = max((i for i, line in enumerate(lines) if line.strip().startswith('---')), default=-1)
+        headings = []
+        for line in lines[last_delimiter + 1:]:
+            match = self.HEADING.match(line)
+            if match and match.group(1) not in headings:
+                headings.append(match.group(1))
+        if not headings:
+            return f"Offline response {seed[:12]}."
+        parts = []
+        for i, heading in enumerate(headings):
+            if heading.endswith('Score'):
+                parts.append(f"**{heading}:** {40 + int(seed[i * 2:i * 2 + 2], 16) % 60}%")
+            else:
+                parts.append(f"**{heading}:** Offline placeholder for {heading.lower()} ({seed[i:i + 8]}).")
+        return "\n\n".join(parts)
+
+
+BACKENDS = {'vertex': VertexBackend, 'fake': FakeBackend}
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if LLM_BACKEND not in BACKENDS:
+                raise BackendConfigError(f"Unknown LLM_BACKEND '{LLM_BACKEND}'. Choose one of: {', '.join(BACKENDS)}.")
+            _backend = BACKENDS[LLM_BACKEND]()
+        return _backend
+
+
+def set_backend(backend):
+    """Replaces the process-wide backend, e.g. with FakeBackend(latency=0.5) for a load test."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+class _UnlimitedLimiter:
+    """Stands in for the shared limiter for backends without a rate limit."""
+
+    requests_per_minute = float('inf')
+
+    def acquire(self):
+        pass
+
+    def on_success(self, latency):
+        pass
+
+    def on_failure(self):
+        pass
+
+    def on_throttle(self):
+        return 0
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveRateLimiter()
+        return _limiter
+
+
+def get_limiter_state():
+    """Returns the shared limiter's allowed requests per minute, queue depth and in-flight calls."""
+    return get_limiter().state()
+
+
+def _record(latency, prompt_tokens=0, output_tokens=0, failed=False, rate_limited=False):
+    with _metrics_lock:
+        _metrics['calls'] += 1
+        _metrics['failures'] += failed
+        _metrics['rate_limited'] += rate_limited
+        _metrics['latency_seconds'] += latency
+        _metrics['max_latency_seconds'] = max(_metrics['max_latency_seconds'], latency)
+        _metrics['prompt_tokens'] += prompt_tokens
+        _metrics['output_tokens'] += output_tokens
+
+
+def _generate_with_retries(backend, prompt, model_name, budget):
+    limiter = get_limiter() if getattr(backend, 'rate_limited', True) else _UnlimitedLimiter()
+    for attempt in range(1, MAX_RETRIES + 1):
+        if budget is not None:
+            budget.acquire(estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS)
+        limiter.acquire()
+        start_time = time.perf_counter()
+        try:
+            text, prompt_tokens, output_tokens = backend.generate(prompt, model_name)
+            latency = time.perf_counter() - start_time
+            limiter.on_success(latency)
+            _record(latency, prompt_tokens, output_tokens)
+            return True, text
+        except RateLimitError:
+            latency = time.perf_counter() - start_time
+            hold_seconds = limiter.on_throttle()
+            _record(latency, failed=True, rate_limited=True)
+            print(f"Rate limit hit. Shared limiter now at {limiter.requests_per_minute:.0f} requests/min, "
+                  f"holding calls for {hold_seconds:.0f} seconds... (Attempt {attempt}/{MAX_RETRIES})")
+        except BlockedResponseError as e:
+            latency = time.perf_counter() - start_time
+            limiter.on_failure()
+            _record(latency, failed=True)
+            return False, f"Response was blocked or empty. Reason: {e}"
+        except BackendConfigError as e:
+            limiter.on_failure()
+            print(f"ERROR: {e}")
+            return False, str(e)
+        except Exception as e:
+            latency = time.perf_counter() - start_time
+            limiter.on_failure()
+            _record(latency, failed=True)
+            print(f"An unexpected error occurred with the {backend.name} LLM backend: {e}")
+            return False, f"An unexpected error occurred: {e}"
+    return False, "Failed to get response after multiple retries due to rate limiting."
+
+
+def generate_text(prompt, model_name=DEFAULT_MODEL, budget=None, use_cache=True):
+    """
+    Returns (success, text) for a prompt; on failure text is the reason.
+    Every attempt waits for the shared rate limiter; budget, if given, is
+    acquired first (see Summarization_agent.QuotaBudget). use_cache=False
+    always calls the model, e.g. for benchmarks.
+    """
+    try:
+        backend = get_backend()
+    except BackendConfigError as e:
+        print(f"ERROR: {e}")
+        return False, str(e)
+    if not use_cache:
+        return _generate_with_retries(backend, prompt, model_name, budget)
+    return cached_completion(
+        backend.cache_namespace + model_name, SAFETY_SETTINGS, prompt,
+        lambda: _generate_with_retries(backend, prompt, model_name, budget)
+    )
+
+
+def get_llm_metrics():
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def print_llm_metrics():
+    metrics = get_llm_metrics()
+    if not metrics['calls']:
+        return
+    average = metrics['latency_seconds'] / metrics['calls']
+    print(f"   LLM calls ({get_backend().name}): {metrics['calls']} ({metrics['failures']} failed, "
+          f"{metrics['rate_limited']} rate limited), avg {average:.2f}s, max {metrics['max_latency_seconds']:.2f}s, "
+          f"{metrics['prompt_tokens']} prompt / {metrics['output_tokens']} output tokens")
+    if not getattr(get_backend(), 'rate_limited', True):
+        return
+    limiter = get_limiter_state()
+    print(f"   LLM rate limiter: {limiter['requests_per_minute']:.0f} requests/min allowed, "
+          f"{limiter['queue_depth']} queued, {limiter['in_flight']} in flight, {limiter['waited_seconds']:.1f}s total queue wait")
@@ -8,7 +8,7 @@ from mysql.connector import Error
 try:
     
     from Retrieval_agent import run_retrieval
-    from Preprocessing_agent import run_preprocessing
+    from Preprocessing_agent import run_preprocessing, run_preprocessing_alongside
     from Summarization_agent import run_summarization
     from Comparative_analysis import run_comparative_analysis
     from Gap_identification import run_gap_identification_agent
@@ -27,6 +27,12 @@ except ImportError as e:
     print(" - Report_generator.py")
     sys.exit(1)
 
+from llm_cache import print_llm_cache_stats
+from llm_client import print_llm_metrics
+
+
+# Extract PDFs while retrieval is still downloading instead of waiting for it to finish.
+OVERLAP_RETRIEVAL_AND_PREPROCESSING = True
 
 DB_CONFIG = {
     'host': 'localhost',
@@ -63,6 +69,15 @@ def clear_database():
         print("   - Truncating 'papers1' table...")
         cursor.execute("TRUNCATE TABLE papers1;")
         
+        print("   - Truncating 'paper_texts' table...")
+        cursor.execute("TRUNCATE TABLE paper_texts;")
+        
+        print("   - Truncating 'paper_pages' table...")
+        cursor.execute("TRUNCATE TABLE paper_pages;")
+        
+        print("   - Truncating 'paper_sections' table...")
+        cursor.execute("TRUNCATE TABLE paper_sections;")
+        
         print("   - Truncating 'analyses' table...")
         cursor.execute("TRUNCATE TABLE analyses;")
         
@@ -84,6 +99,8 @@ def clear_database():
 
 
 
+
+
 def print_header(title):
     """Prints a formatted header to clearly mark the start of an agent's task."""
     print("\n" + "="*80)
@@ -112,8 +129,9 @@ def main():
     
 
     
-    print("⚠ IMPORTANT: Before you begin, ensure you have filled in your GCP_PROJECT_ID")
-    print("   and database password in ALL relevant agent scripts.")
+    print("⚠ IMPORTANT: Before you begin, set GCP_PROJECT_ID in llm_client.py (or as an")
+    print("   environment variable) and the database password in ALL relevant agent scripts.")
+    print("   Set LLM_BACKEND=fake to run the whole pipeline offline with deterministic responses.")
     print("   Also, ensure you are using the CORRECTED Summarization_agent.py.")
     print("-"*80)
 
@@ -131,14 +149,19 @@ def main():
     
     try:
       
-        print_header("1. Retrieval Agent")
-        run_retrieval(search_topic)
-        print_footer("1. Retrieval Agent")
-        
-        
-        print_header("2. Preprocessing Agent")
-        run_preprocessing()
-        print_footer("2. Preprocessing Agent")
+        if OVERLAP_RETRIEVAL_AND_PREPROCESSING:
+            print_header("1-2. Retrieval + Preprocessing Agents (overlapped)")
+            run_preprocessing_alongside(lambda: run_retrieval(search_topic), name="retrieval")
+            print_footer("1-2. Retrieval + Preprocessing Agents (overlapped)")
+        else:
+            print_header("1. Retrieval Agent")
+            run_retrieval(search_topic)
+            print_footer("1. Retrieval Agent")
+            
+            
+            print_header("2. Preprocessing Agent")
+            run_preprocessing()
+            print_footer("2. Preprocessing Agent")
 
         
         print_header("3. Summarization Agent")
@@ -175,6 +198,8 @@ def main():
         total_time = end_time - start_time
         print("\n" + "="*80)
         print(f" PIPELINE RUN FINISHED in {total_time:.2f} seconds.")
+        print_llm_cache_stats()
+        print_llm_metrics()
        
         print(f"   Check the '{os.path.join('reports')}' folder for the final PDF report.")
         print("   Downloaded papers are in the 'downloads' folder.")
@@ -12,6 +12,67 @@ CREATE TABLE papers1 (
     abstract TEXT,
     retrieved_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     file_path VARCHAR(512),
-    full_text LONGTEXT,
+    pdf_sha256 CHAR(64) UNIQUE,
+    doi VARCHAR(255),
+    arxiv_id VARCHAR(64),
+    quality_reason VARCHAR(255),
     summary TEXT
 );
+
+-- One row per paper with extracted text; the text itself is in paper_pages (see fulltext_store.py)
+CREATE TABLE paper_texts (
+    paper_id INT PRIMARY KEY,
+    page_count INT NOT NULL,
+    raw_bytes INT NOT NULL,
+    compressed_bytes INT NOT NULL
+);
+
+-- Extracted text, stored only here: one compressed row per PDF page, so later
+-- stages can read page ranges. The full text is the concatenation of the pages.
+CREATE TABLE paper_pages (
+    paper_id INT NOT NULL,
+    page_number INT NOT NULL,
+    codec VARCHAR(8) NOT NULL,
+    raw_bytes INT NOT NULL,
+    content MEDIUMBLOB,
+    PRIMARY KEY (paper_id, page_number)
+);
+
+-- Section boundaries found during extraction, as character offsets into full_text
+CREATE TABLE paper_sections (
+    paper_id INT NOT NULL,
+    section VARCHAR(32) NOT NULL,
+    start_offset INT NOT NULL,
+    end_offset INT NOT NULL,
+    INDEX (paper_id)
+);
+
+-- Extracted documents (zlib-compressed JSON of pages and sections) keyed by PDF
+-- digest and extractor version. Not truncated between runs.
+CREATE TABLE extraction_cache (
+    pdf_sha256 CHAR(64) NOT NULL,
+    extractor_version VARCHAR(64) NOT NULL,
+    content LONGBLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (pdf_sha256, extractor_version)
+);
+
+-- Existing databases: add the PDF content digest column
+-- ALTER TABLE papers1 ADD COLUMN pdf_sha256 CHAR(64) UNIQUE AFTER file_path;
+
+-- Existing databases: add the identifiers used for cross-source deduplication
+-- ALTER TABLE papers1 ADD COLUMN doi VARCHAR(255) AFTER pdf_sha256, ADD COLUMN arxiv_id VARCHAR(64) AFTER doi;
+
+-- Existing databases: full text now lives in paper_texts (re-run preprocessing to fill it)
+-- ALTER TABLE papers1 DROP COLUMN full_text;
+
+-- Existing databases: why a paper's extracted text was kept out of summarization
+-- ALTER TABLE papers1 ADD COLUMN quality_reason VARCHAR(255) AFTER arxiv_id;
+
+-- Existing databases: pages are stored compressed like paper_texts (re-run preprocessing to refill them)
+-- TRUNCATE TABLE paper_pages;
+-- ALTER TABLE paper_pages ADD COLUMN codec VARCHAR(8) NOT NULL AFTER page_number, ADD COLUMN raw_bytes INT NOT NULL AFTER codec, MODIFY content MEDIUMBLOB;
+
+-- Existing databases: paper_pages is now the only copy of the text (re-run preprocessing to refill both tables)
+-- TRUNCATE TABLE paper_texts;
+-- ALTER TABLE paper_texts DROP COLUMN content, DROP COLUMN codec, ADD COLUMN page_count INT NOT NULL AFTER paper_id;